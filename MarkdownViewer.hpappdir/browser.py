@@ -14,9 +14,10 @@ from hpprime import fillrect
 from graphics import draw_text, draw_rectangle, text_width
 from keycodes import KEY_UP, KEY_DOWN, KEY_ENTER, KEY_ESC
 from file_ops import list_files, get_file_size
-from input_helpers import get_key, get_touch, get_menu_tap
+from input_helpers import poll_input, get_menu_tap, PollPolicy
 from ui import draw_menu
 import file_prefs
+import tasks
 
 # Column layout (pixel positions)
 _COL_FAV_X = const(7)
@@ -168,8 +169,6 @@ def file_picker(title="Files", subtitle="Select a file", ext=None,
     touch_start_time = 0
     long_press_fired = False
 
-    from input_helpers import get_ticks
-
     def _fav_color():
         c = _get_colors(colors)
         return c.get('fav_star', 0xCCA000)
@@ -380,10 +379,11 @@ def file_picker(title="Files", subtitle="Select a file", ext=None,
 
     draw_screen()
 
+    poll = PollPolicy()
     try:
         while True:
-            key = get_key()
-            if key > 0:
+            key, tx, ty, now = poll_input(poll)
+            if key >= 0:
                 if key == KEY_UP:
                     if selected > 0:
                         selected -= 1
@@ -398,20 +398,21 @@ def file_picker(title="Files", subtitle="Select a file", ext=None,
                 elif key == KEY_ESC:
                     return None
 
-            tx, ty = get_touch()
+            poll.update(key >= 0 or tx >= 0)
+            poll.work = False
             if tx >= 0 and ty >= 0:
                 if not touch_down:
                     touch_down = True
                     tap_x = tx
                     tap_y = ty
-                    touch_start_time = get_ticks()
+                    touch_start_time = now
                     long_press_fired = False
                 else:
                     # Long press detection for tag assignment
                     if (not long_press_fired and items
                             and tap_y >= _ITEM_Y0 and tap_y < menu_y
                             and abs(tx - tap_x) + abs(ty - tap_y) < 10):
-                        elapsed = get_ticks() - touch_start_time
+                        elapsed = now - touch_start_time
                         if elapsed >= 600:  # LONG_PRESS_MS
                             long_press_fired = True
                             start_row = 0
@@ -466,6 +467,8 @@ def file_picker(title="Files", subtitle="Select a file", ext=None,
                         else:
                             selected = tapped
                             draw_screen()
+            elif key < 0:
+                poll.work = tasks.run()
 
     except KeyboardInterrupt:
         return None
@@ -43,3 +43,31 @@ DRAG_THRESHOLD = const(3)
 
 # Long press (milliseconds)
 LONG_PRESS_MS = const(600)
+
+# Incremental layout: lines measured per idle chunk, and pixels laid out
+# past the bottom of the viewport before the first paint
+MEASURE_CHUNK = const(40)
+MEASURE_LOOKAHEAD = const(120)
+# Compiled display-list records kept per cache generation; older ones are
+# dropped and compiled again when they scroll back into view
+RECORD_CACHE_SIZE = const(64)
+# Source lines whose word-wrap positions are kept per cache generation
+WRAP_CACHE_LINES = const(128)
+# Lay out the other body fonts during idle time once the current layout
+# and search index are complete (0 = only keep layouts already visited)
+PREFETCH_FONTS = const(1)
+# Lines added to the search index per idle step once layout is complete
+SEARCH_INDEX_CHUNK = const(100)
+# A search stops collecting (line, offset) matches after this many
+SEARCH_MAX_MATCHES = const(1000)
+# Time budget (ms) for one regular-expression search
+SEARCH_REGEX_MS = const(1500)
+
+# Scroll strip cache: off-screen buffer holding rendered content around
+# the viewport, three full viewport heights tall
+GR_STRIP = const(3)
+STRIP_HEIGHT = const(696)
+
+# Documents at least this large are opened with the on-demand line index
+# (line_store.IndexedLines) instead of being read into a list of strings
+INDEXED_LOAD_BYTES = const(65536)
@@ -0,0 +1,156 @@
+"""Recently viewed documents kept in memory for back/forward navigation.
+
+Leaving a document through a link parks its MarkdownViewer (lines,
+layout, search index and kept font layouts) here instead of closing
+it, so going back or forward to it needs no reload or measurement.
+
+The cache is a short most-recent-last list bounded by DOC_CACHE_SIZE
+entries and by the free heap: after parking a viewer, the oldest ones
+are closed while less than DOC_CACHE_MIN_FREE bytes remain.  A parked
+document whose file size changed on disk is reloaded instead.
+
+prefetch_step() uses idle time to load and lay out documents linked
+from the visible part of the current one, one MEASURE_CHUNK at a time,
+and parks them here.  It only starts a prefetch while the cache has a
+free slot and at least PREFETCH_MIN_FREE bytes of heap, so it never
+evicts documents the user has already seen.  Loading a file (read,
+digest, sidecar) is a single step that cannot yield to input, so
+links to files of INDEXED_LOAD_BYTES or more are not prefetched.
+"""
+
+from micropython import const
+import gc
+from file_ops import get_file_size
+from constants import INDEXED_LOAD_BYTES
+
+DOC_CACHE_SIZE = const(3)          # parked viewers at most
+DOC_CACHE_MIN_FREE = const(65536)  # free heap to keep after parking
+PREFETCH_MIN_FREE = const(131072)  # free heap needed to start a prefetch
+
+_entries = []       # [filename, viewer, file size], oldest first
+_pending = None     # [filename, viewer] being prefetched
+_failed = []        # links that could not be loaded or are too large
+
+
+def _evict(i):
+    e = _entries.pop(i)
+    try:
+        e[1].close()
+    except:
+        pass
+
+
+def put(filename, viewer):
+    """Park a viewer that is being left; evict old ones as needed."""
+    take(filename, False)
+    _entries.append([filename, viewer, get_file_size(filename)])
+    while len(_entries) > DOC_CACHE_SIZE:
+        _evict(0)
+    gc.collect()
+    try:
+        while _entries and gc.mem_free() < DOC_CACHE_MIN_FREE:
+            _evict(0)
+            gc.collect()
+    except:
+        pass
+
+
+def take(filename, keep=True):
+    """Remove and return the parked viewer for filename, or None.
+
+    With keep=False the viewer is closed instead of returned.  A
+    document still being prefetched is returned as it is; its layout
+    continues in the viewer's own idle steps.
+    """
+    global _pending
+    p = _pending
+    if p and p[0] == filename:
+        _pending = None
+        if keep:
+            return p[1]
+        p[1].close()
+    for i in range(len(_entries)):
+        if _entries[i][0] == filename:
+            if not keep or _entries[i][2] != get_file_size(filename):
+                _evict(i)
+                return None
+            return _entries.pop(i)[1]
+    return None
+
+
+def _has(filename):
+    for e in _entries:
+        if e[0] == filename:
+            return True
+    return False
+
+
+def _room():
+    if len(_entries) >= DOC_CACHE_SIZE:
+        return False
+    try:
+        return gc.mem_free() >= PREFETCH_MIN_FREE
+    except:
+        return True
+
+
+def prefetch_step(links, current, open_viewer):
+    """Advance idle prefetching of the documents in links.
+
+    current is the file on screen; open_viewer(filename) returns a
+    viewer with the file loaded, or None if it cannot be loaded.  Each
+    call does one unit of work (a load or a layout chunk) so input is
+    polled in between.  Returns True while there is work left.
+    """
+    global _pending
+    p = _pending
+    if p and p[0] not in links:
+        # Scrolled away from the link: drop the partial document
+        _pending = None
+        p[1].close()
+        p = None
+        gc.collect()
+    if p is None:
+        name = None
+        for n in links:
+            if n != current and n not in _failed and not _has(n):
+                name = n
+                break
+        if name is None or not _room():
+            return False
+        if get_file_size(name) >= INDEXED_LOAD_BYTES:
+            _failed.append(name)
+            return True
+        try:
+            v = open_viewer(name)
+        except MemoryError:
+            v = None
+        if v is None:
+            _failed.append(name)
+        else:
+            _pending = [name, v]
+        return True
+    try:
+        done = p[1].preload_step()
+    except MemoryError:
+        _pending = None
+        _failed.append(p[0])
+        p[1].close()
+        gc.collect()
+        return False
+    if done:
+        _pending = None
+        _entries.append([p[0], p[1], get_file_size(p[0])])
+    return True
+
+
+def clear():
+    """Close every parked viewer and any prefetch in progress."""
+    global _pending
+    if _pending:
+        _pending[1].close()
+        _pending = None
+    del _failed[:]
+    while _entries:
+        _evict(0)
+    gc.collect()
@@ -7,6 +7,12 @@ Persistence:
     .favorites  — one pinned filename per line
     .recent     — one recent filename per line (most recent first)
     .progress   — filename:percent per line
+    .positions  — filename:scroll offset per line
+    .tags       — filename:tag id per line
+
+Changes are kept in memory and written later: flush_step() writes one
+changed file per call (run as a background task while idle) and
+flush() writes all of them before the app exits.
 """
 
 from micropython import const
@@ -58,7 +64,7 @@ def toggle_favorite(filename):
         favs.append(filename)
         is_pinned = True
     _favorites = favs
-    _save_favorites_file(favs)
+    _mark('.favorites')
     return favs, is_pinned
 
 
@@ -120,7 +126,7 @@ def add_recent(filename):
     recent.insert(0, filename)
     recent = recent[:MAX_RECENT]
     _recent = recent
-    _save_recent_file(recent)
+    _mark('.recent')
     return recent
 
 
@@ -179,7 +185,7 @@ def set_progress(filename, percent):
         _progress = _load_progress_file()
     pct = max(0, min(100, int(percent)))
     _progress[filename] = pct
-    _save_progress_file(_progress)
+    _mark('.progress')
 
 
 # --- Per-file scroll positions ---
@@ -232,7 +238,7 @@ def set_scroll_pos(filename, pos):
     if _positions is None:
         _positions = _load_positions()
     _positions[filename] = int(pos)
-    _save_positions(_positions)
+    _mark('.positions')
 
 
 # --- File tags / categories ---
@@ -289,4 +295,41 @@ def set_tag(filename, tag_id):
     if _tags is None:
         _tags = _load_tags()
     _tags[filename] = tag_id
-    _save_tags(_tags)
+    _mark('.tags')
+
+
+# --- Deferred writes ---
+
+_dirty = []     # prefs files changed since they were last written
+
+
+def _mark(name):
+    if name not in _dirty:
+        _dirty.append(name)
+
+
+def _write(name):
+    if name == '.favorites':
+        _save_favorites_file(_favorites)
+    elif name == '.recent':
+        _save_recent_file(_recent)
+    elif name == '.progress':
+        _save_progress_file(_progress)
+    elif name == '.positions':
+        _save_positions(_positions)
+    elif name == '.tags':
+        _save_tags(_tags)
+
+
+def flush_step():
+    """Write one changed prefs file. Returns True if it wrote one."""
+    if not _dirty:
+        return False
+    _write(_dirty.pop(0))
+    return True
+
+
+def flush():
+    """Write every changed prefs file."""
+    while flush_step():
+        pass
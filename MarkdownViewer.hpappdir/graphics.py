@@ -1,9 +1,81 @@
 from hpprime import eval, fillrect, dimgrob
+import gc
+
+
+# Command batching: while a batch is open, TEXTOUT_P/RECT_P/BLIT_P
+# commands are queued and sent to PPL as one ';'-joined eval instead
+# of one interpreter round trip each.  Only idempotent drawing may be
+# queued: if the joined eval fails partway, flush() replays the whole
+# batch, so commands that already ran are drawn again.  Anything with
+# side effects (assignments, blended blits) goes through _run_now().
+BATCH_MAX_CHARS = 1024  # flush once the joined command reaches this size
+_batch = []
+_batch_len = 0
+_batching = False
+_batch_ok = True        # cleared once joined commands fail but run singly
+
+
+def begin_batch():
+    """Start queueing drawing commands until end_batch()."""
+    global _batching
+    _batching = _batch_ok
+
+
+def flush():
+    """Send queued drawing commands as a single eval.
+
+    Call before any native hpprime drawing (strblit2, dimgrob, ...)
+    that must see the queued output.
+    """
+    global _batch_len, _batching, _batch_ok
+    if not _batch:
+        return
+    try:
+        try:
+            eval(';'.join(_batch))
+        except:
+            # Replay them one at a time; a bad command raises from here
+            for cmd in _batch:
+                eval(cmd)
+            # Each runs alone, so the firmware rejects joined commands
+            _batch_ok = False
+            _batching = False
+    finally:
+        del _batch[:]
+        _batch_len = 0
+
+
+def end_batch():
+    """Flush queued commands and return to immediate drawing."""
+    global _batching
+    flush()
+    _batching = False
+
+
+def _run(cmd):
+    """Evaluate a PPL drawing command, or queue it inside a batch."""
+    global _batch_len
+    if _batching:
+        _batch.append(cmd)
+        _batch_len += len(cmd) + 1
+        if _batch_len >= BATCH_MAX_CHARS:
+            flush()
+    else:
+        eval(cmd)
+
+
+def _run_now(cmd):
+    """Evaluate a command that must run exactly once, after the queue."""
+    flush()
+    eval(cmd)
 
 
 def draw_rectangle(gr, x1, y1, x2, y2, edge_color, edge_alpha,
               fill_color=0x0, fill_alpha=255):
     """Draw a rectangle with edge and fill colors."""
+    if _batching:
+        # Native drawing must land after the queued text
+        flush()
     fillrect(gr, x1, y1, x2 - x1, y2 - y1, edge_color, fill_color)
 
 
@@ -32,43 +104,178 @@ def draw_text(gr, x, y, text, fontsize, text_color, width=320, bg_color=None):
                                    (bg_color >> 8) & 0xFF,
                                    bg_color & 0xFF)
             _rgb_cache[bg_color] = bg_rgb
-        eval('TEXTOUT_P("%s",G%d,%d,%d,%d,RGB(%s),%d,RGB(%s))'
+        _run('TEXTOUT_P("%s",G%d,%d,%d,%d,RGB(%s),%d,RGB(%s))'
              % (safe, gr, x, y, fontsize, rgb, width, bg_rgb))
     else:
-        eval('TEXTOUT_P("%s",G%d,%d,%d,%d,RGB(%s),%d)'
+        _run('TEXTOUT_P("%s",G%d,%d,%d,%d,RGB(%s),%d)'
              % (safe, gr, x, y, fontsize, rgb, width))
 
 
+# Glyph advance tables: fontsize -> {char: advance in pixels}.  Word
+# widths are summed from per-character advances, so TEXTSIZE is only
+# evaluated once per glyph.  Printable ASCII is calibrated up front;
+# other glyphs are measured the first time they appear.  Tables are
+# persisted to .glyphs as one line per font:  <font> <code>:<adv>,...
+_adv = {}
+_adv_dirty = False
+_adv_loaded = False
+
+
+def _measure(text, fontsize):
+    """Measure text with TEXTSIZE. Returns the width or None on failure."""
+    try:
+        result = eval('TEXTSIZE("%s",%d)' % (_escape_text(text), fontsize))
+        if type(result) is list:
+            result = result[0]
+        return int(result)
+    except:
+        return None
+
+
+def _load_glyph_tables():
+    global _adv_loaded
+    _adv_loaded = True
+    try:
+        with open('.glyphs', 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) != 2:
+                    continue
+                table = {}
+                for item in parts[1].split(','):
+                    code, a = item.split(':')
+                    table[chr(int(code))] = int(a)
+                _adv[int(parts[0])] = table
+    except:
+        pass
+
+
+def save_glyph_tables():
+    """Persist glyph advance tables if new glyphs were measured."""
+    global _adv_dirty
+    if not _adv_dirty:
+        return
+    try:
+        with open('.glyphs', 'w') as f:
+            for font in _adv:
+                table = _adv[font]
+                f.write('%d %s\n' % (font, ','.join(
+                    ['%d:%d' % (ord(ch), table[ch]) for ch in table])))
+        _adv_dirty = False
+    except:
+        pass
+
+
+def _glyph_table(fontsize):
+    """Return the advance table for a font, calibrating it if needed."""
+    global _adv_dirty
+    if not _adv_loaded:
+        _load_glyph_tables()
+    table = _adv.get(fontsize)
+    if table is None:
+        table = {}
+        for code in range(32, 127):
+            a = _measure(chr(code), fontsize)
+            if a is None:
+                return None
+            table[chr(code)] = a
+        _adv[fontsize] = table
+        _adv_dirty = True
+        save_glyph_tables()
+    return table
+
+
 # Text width cache: (text, fontsize) -> pixel width
-# Avoids repeated PPL eval('TEXTSIZE(...)') calls for the same words
-_tw_cache = {}
-_TW_CACHE_MAX = 200  # max entries before clearing
+# Two generations approximate an LRU without per-hit bookkeeping: new
+# entries go into the young dict; when it fills up it becomes the old
+# generation and the previous old one is dropped.  Hits in the old
+# generation are promoted, so words in steady use survive the swap.
+TW_CACHE_MIN = 64       # per-generation size bounds for adapt
+TW_CACHE_MAX = 1024
+TW_LOW_HEAP = 16384     # shrink below this much free heap at a swap
+TW_HIGH_HEAP = 65536    # grow above it
+_tw_young = {}
+_tw_old = {}
+_tw_limit = 200         # entries per generation
+_tw_hits = 0
+_tw_misses = 0
+_tw_evictions = 0
+
+
+def set_text_cache_size(limit):
+    """Set the per-generation size of the text width cache."""
+    global _tw_limit
+    _tw_limit = max(TW_CACHE_MIN, min(TW_CACHE_MAX, limit))
+
+
+def text_cache_stats():
+    """Return (hits, misses, evictions, entries, limit) for text_width."""
+    return (_tw_hits, _tw_misses, _tw_evictions,
+            len(_tw_young) + len(_tw_old), _tw_limit)
+
+
+def _tw_swap():
+    """Age the young generation and resize it to the free heap."""
+    global _tw_young, _tw_old, _tw_evictions
+    _tw_evictions += len(_tw_old)
+    _tw_old = _tw_young
+    _tw_young = {}
+    try:
+        free = gc.mem_free()
+    except:
+        return
+    if free < TW_LOW_HEAP:
+        set_text_cache_size(_tw_limit // 2)
+    elif free > TW_HIGH_HEAP:
+        set_text_cache_size(_tw_limit * 2)
 
 
 def text_width(text, fontsize):
-    """Get the pixel width of text at the given font size (cached)."""
-    global _tw_cache
+    """Get the pixel width of text at the given font size (cached).
+
+    Sums per-glyph advances; glyphs not in the table are measured once
+    with TEXTSIZE.  Falls back to measuring the whole string if the
+    table cannot be calibrated.
+    """
+    global _tw_hits, _tw_misses, _adv_dirty
     key = (text, fontsize)
-    w = _tw_cache.get(key)
+    w = _tw_young.get(key)
     if w is not None:
+        _tw_hits += 1
         return w
-    safe = _escape_text(text)
-    result = eval('TEXTSIZE("%s",%d)' % (safe, fontsize))
-    if type(result) is list:
-        w = result[0]
+    w = _tw_old.get(key)
+    if w is not None:
+        _tw_hits += 1
     else:
-        w = result
-    # Evict entire cache if too large to avoid unbounded memory growth
-    if len(_tw_cache) >= _TW_CACHE_MAX:
-        _tw_cache = {}
-    _tw_cache[key] = w
+        _tw_misses += 1
+        table = _glyph_table(fontsize)
+        w = 0
+        if table is not None:
+            for ch in text:
+                a = table.get(ch)
+                if a is None:
+                    a = _measure(ch, fontsize)
+                    if a is None:
+                        w = None
+                        break
+                    table[ch] = a
+                    _adv_dirty = True
+                w += a
+        else:
+            w = None
+        if w is None:
+            w = _measure(text, fontsize) or 0
+    if len(_tw_young) >= _tw_limit:
+        _tw_swap()
+    _tw_young[key] = w
     return w
 
 
 def text_width_clear_cache():
     """Clear the text_width cache (call on theme change if fonts change)."""
-    global _tw_cache
-    _tw_cache = {}
+    global _tw_young, _tw_old
+    _tw_young = {}
+    _tw_old = {}
 
 
 def draw_image(gr, x, y, pixel_data, img_width, img_height,
@@ -80,6 +287,7 @@ def draw_image(gr, x, y, pixel_data, img_width, img_height,
     Draws to a temp buffer first, then blits to the destination in one call.
     Consecutive same-color pixels in each row are merged into a single fillrect.
     """
+    flush()
     # Create temp grob filled with white (matches background)
     dimgrob(tmp_gr, img_width, img_height, 0xFFFFFF)
 
@@ -129,9 +337,9 @@ def open_file(gr, name, app_name=""):
     app_name: app name for cross-app file access (optional)
     """
     if app_name == "":
-        eval('G%d:=AFiles("%s")' % (gr, name))
+        _run_now('G%d:=AFiles("%s")' % (gr, name))
     else:
-        eval('G%d:=EXPR(REPLACE("%s"," ","_")+".AFiles(""%s"")")' % (gr, app_name, name))
+        _run_now('G%d:=EXPR(REPLACE("%s"," ","_")+".AFiles(""%s"")")' % (gr, app_name, name))
 
 
 def blit(gr, dx1, dy1, dx2, dy2, src_gr, sx1, sy1, sx2, sy2,
@@ -152,7 +360,11 @@ def blit(gr, dx1, dy1, dx2, dy2, src_gr, sx1, sy1, sx2, sy2,
     else:
         cmd = "BLIT_P(G{0},{1},{2},{3},{4},G{5},{6},{7},{8},{9})".format(
             gr, dx1, dy1, dx2, dy2, src_gr, sx1, sy1, sx2, sy2)
-    eval(cmd)
+    # Blending, or copying within one buffer, changes the result if repeated
+    if transp_alpha != 255 or src_gr == gr:
+        _run_now(cmd)
+    else:
+        _run(cmd)
 
 
 def _parse_func_args(s):
@@ -282,11 +494,11 @@ def render_formula(gr, dest_x, dest_y, expr, expr_w, expr_h,
     y2 = y1 + gh + 1
 
     # Draw bordered box with theme background
-    eval("RECT_P(G%d,%d,%d,%d,%d,%s,%s)" %
+    _run("RECT_P(G%d,%d,%d,%d,%d,%s,%s)" %
          (gr, x1, y1, x2, y2, bc, bgc))
 
     # Draw formatted text
-    eval('TEXTOUT_P("%s",G%d,%d,%d,%d,%s,%d)' %
+    _run('TEXTOUT_P("%s",G%d,%d,%d,%d,%s,%d)' %
          (safe, gr, x1 + pad, y1 + pad, FORMULA_FONT, tc, gw))
 
 
@@ -295,6 +507,7 @@ def get_grob_size(gr):
 
     Returns (width, height) or None on failure.
     """
+    flush()
     try:
         w = int(eval('GROBW_P(G%d)' % gr) or 0)
         h = int(eval('GROBH_P(G%d)' % gr) or 0)
@@ -3,21 +3,62 @@
 Reusable — no app-specific dependencies.
 """
 
+from micropython import const
 from hpprime import eval as heval
 
-
-def get_key():
-    """Read the current key code, or 0 if none pressed."""
-    heval('wait(1/20)')
-    k = heval('GETKEY()')
-    return k if k > 0 else 0
-
-
-def get_key_fast():
-    """Read key with shorter wait — use during scrolling/drag for responsiveness."""
-    heval('wait(1/50)')
+POLL_ACTIVE_MS = const(10)     # sleep per poll right after input
+POLL_IDLE_MAX_MS = const(100)  # longest sleep once idle
+POLL_BACKOFF = const(8)        # idle polls per doubling of the sleep
+
+
+class PollPolicy:
+    """How long an event loop sleeps before each input poll.
+
+    Polls are tight (POLL_ACTIVE_MS) while a touch or key (including
+    key repeat) is active; once idle, the sleep doubles every
+    POLL_BACKOFF polls up to POLL_IDLE_MAX_MS.  While the loop sets
+    work (background work is pending) it does not sleep at all, since
+    the work already spaces the polls out.
+    """
+
+    def __init__(self):
+        self._ms = POLL_ACTIVE_MS
+        self._idle = 0      # idle polls since the sleep last changed
+        self.work = False
+
+    def update(self, active):
+        """Record whether the last poll saw a key or touch."""
+        if active:
+            self._ms = POLL_ACTIVE_MS
+            self._idle = 0
+        elif self._ms < POLL_IDLE_MAX_MS:
+            self._idle += 1
+            if self._idle >= POLL_BACKOFF:
+                self._ms = min(POLL_IDLE_MAX_MS, self._ms * 2)
+                self._idle = 0
+
+    def sleep_ms(self):
+        """Return how long to sleep before the next poll (0: don't)."""
+        return 0 if self.work else self._ms
+
+    def wait(self):
+        """Sleep before the next poll."""
+        ms = self.sleep_ms()
+        if ms:
+            heval('wait(%d/1000)' % ms)
+
+
+def get_key(poll=None):
+    """Read the current key code, or -1 if none pressed.
+
+    Sleeps first as poll (a PollPolicy) decides, or 1/20 s without one.
+    """
+    if poll is None:
+        heval('wait(1/20)')
+    else:
+        poll.wait()
     k = heval('GETKEY()')
-    return k if k > 0 else 0
+    return k if k >= 0 else -1
 
 
 def get_touch_y():
@@ -33,9 +74,8 @@ def get_touch_y():
     return -1
 
 
-def get_touch():
-    """Get (x, y) of the current touch, or (-1, -1) if not touching."""
-    m = heval("mouse")
+def _touch(m):
+    """Decode a mouse result into (x, y), or (-1, -1) if not touching."""
     if m:
         f = m[0]
         if type(f) is list:
@@ -46,6 +86,11 @@ def get_touch():
     return (-1, -1)
 
 
+def get_touch():
+    """Get (x, y) of the current touch, or (-1, -1) if not touching."""
+    return _touch(heval("mouse"))
+
+
 def mouse_clear():
     """Drain all pending touch events to prevent ghost taps / bounce."""
     while heval('mouse(1)') >= 0:
@@ -57,6 +102,35 @@ def get_ticks():
     return int(heval('ticks()'))
 
 
+_combined = True    # False once the one-eval poll has failed
+
+
+def poll_input(poll=None):
+    """Poll keys, touch and the clock in one eval.
+
+    Returns (key, x, y, ticks) with the values get_key(poll),
+    get_touch() and get_ticks() would give, including the sleep
+    before the poll.  The PPL list is evaluated left to right, so the
+    wait, GETKEY, mouse and ticks run in the same order as the
+    separate calls.  Falls back to those calls if the firmware
+    rejects the combined expression.
+    """
+    global _combined
+    ms = 50 if poll is None else poll.sleep_ms()
+    if _combined:
+        try:
+            r = heval('{%s,GETKEY(),mouse,ticks()}'
+                      % ('wait(%d/1000)' % ms if ms else '0'))
+            k = r[1]
+            x, y = _touch(r[2])
+            return (k if k >= 0 else -1, x, y, int(r[3]))
+        except:
+            _combined = False
+    k = get_key(poll)
+    x, y = get_touch()
+    return (k, x, y, get_ticks())
+
+
 def get_menu_tap(tx, ty, menu_y=220, menu_h=20):
     """If (tx, ty) is in a 6-slot menu bar, return slot index 0-5. Else -1."""
     if ty >= menu_y and ty < menu_y + menu_h:
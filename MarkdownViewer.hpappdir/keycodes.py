@@ -19,3 +19,29 @@ KEY_ON = const(46)
 KEY_PLUS = const(50)
 KEY_MINUS = const(45)
 KEY_LOG = const(25)
+KEY_ALPHA = const(36)
+KEY_SHIFT = const(41)
+
+# Characters typed by each key in text entry: the alpha (letter) legends,
+# and the digit/operator legends used when letter mode is off.
+ALPHA_CHARS = {
+    14: 'a', 15: 'b', 16: 'c', 17: 'd', 18: 'e', 20: 'f', 21: 'g',
+    22: 'h', 23: 'i', 24: 'j', 25: 'k', 26: 'l', 27: 'm', 28: 'n',
+    29: 'o', 31: 'p', 32: 'q', 33: 'r', 34: 's', 35: 't', 37: 'u',
+    38: 'v', 39: 'w', 40: 'x', 42: 'y', 43: 'z', 44: '#', 45: ':',
+    47: '"', 48: '=', 49: ' ', 50: ';',
+}
+DIGIT_CHARS = {
+    20: '^', 28: '(', 29: ',', 32: '7', 33: '8', 34: '9', 35: '/',
+    37: '4', 38: '5', 39: '6', 40: '*', 42: '1', 43: '2', 44: '3',
+    45: '-', 47: '0', 48: '.', 49: ' ', 50: '+',
+}
+# Regular-expression symbols on the digit keys (third ALPHA mode).
+SYMBOL_CHARS = {
+    20: '^', 28: '(', 29: ')', 32: '[', 33: ']', 34: '\\', 35: '|',
+    37: '{', 38: '}', 39: ',', 40: '*', 42: '?', 43: '$', 44: '#',
+    45: '-', 47: '_', 48: '.', 49: ' ', 50: '+',
+}
+# Legend for the keypad part of SYMBOL_CHARS, by row (7 8 9 /, 4 5 6 *,
+# 1 2 3 -, 0 . space +); ^ ( ) stay on their own keys.
+SYMBOL_LEGEND = '[ ] \\ |   { } , *   ? $ # -   _ . sp +'
@@ -0,0 +1,90 @@
+"""Per-document layout sidecar for MarkdownViewer.
+
+Stores the result of a full measurement pass so reopening a document
+skips layout.  One sidecar per document, named .<filename>.lay:
+
+    <size>:<digest>:<font>:<wrap>:<width>
+    <content height>
+    <Y offset per line, comma-separated>
+    <fence state per line, one digit each>
+    <1 per line folded into the previous record, else 0>
+    <width>,<height>:<expr>     (one line per cached formula size)
+
+The first line is the key; a sidecar is only used when every field
+matches the current document and renderer settings.
+"""
+
+try:
+    from uhashlib import sha256 as _sha
+except:
+    try:
+        from hashlib import sha256 as _sha
+    except:
+        _sha = None
+
+
+def _path(filename):
+    return '.' + filename + '.lay'
+
+
+def digest(lines):
+    """Return a short hex digest of the document lines (str or bytes)."""
+    if _sha is None:
+        h = 0
+        for line in lines:
+            h = (h * 31 + hash(line)) & 0xFFFFFFF
+        return '%x' % h
+    d = _sha()
+    for line in lines:
+        d.update(line if type(line) is bytes else line.encode())
+        d.update(b'\n')
+    return ''.join(['%02x' % b for b in d.digest()[:8]])
+
+
+def make_key(doc_key, font, wrap, width):
+    """Build the sidecar key from 'size:digest' and renderer settings."""
+    return '%s:%d:%d:%d' % (doc_key, font, 1 if wrap else 0, width)
+
+
+def load(filename, doc_key):
+    """Load the sidecar if its key starts with doc_key ('size:digest').
+
+    Returns (key, content_height, ys, fences, conts, formulas) or None.
+    """
+    try:
+        with open(_path(filename), 'r') as f:
+            key = f.readline().strip()
+            if not key.startswith(doc_key + ':'):
+                return None
+            height = int(f.readline())
+            ys = [int(v) for v in f.readline().strip().split(',') if v]
+            fences = [int(c) for c in f.readline().strip()]
+            conts = [c == '1' for c in f.readline().strip()]
+            formulas = {}
+            for line in f:
+                line = line.rstrip('\r\n')
+                sep = line.find(':')
+                if sep > 0:
+                    w, h = line[:sep].split(',')
+                    formulas[line[sep + 1:]] = (int(w), int(h))
+        if len(fences) != len(ys) or len(conts) != len(ys):
+            return None
+        return (key, height, ys, fences, conts, formulas)
+    except:
+        return None
+
+
+def save(filename, key, height, ys, fences, conts, formulas):
+    """Write the sidecar for a fully measured document."""
+    try:
+        with open(_path(filename), 'w') as f:
+            f.write(key + '\n')
+            f.write(str(height) + '\n')
+            f.write(','.join([str(y) for y in ys]) + '\n')
+            f.write(''.join([str(c) for c in fences]) + '\n')
+            f.write(''.join(['1' if c else '0' for c in conts]) + '\n')
+            for expr in formulas:
+                w, h = formulas[expr]
+                f.write('%d,%d:%s\n' % (w, h, expr))
+    except:
+        pass
@@ -0,0 +1,170 @@
+"""Compact line storage for documents.
+
+Both stores are read-only sequences of document lines (len, indexing,
+iteration) that avoid one str object per line:
+
+    PackedLines   the whole file as one bytes buffer plus an array of
+                  line start offsets
+    IndexedLines  only the offsets; lines are read from the file on
+                  demand, a block at a time, via seek()
+
+Decoded strings are kept in a small two-generation cache (the same
+scheme as the text width cache), so the visible window and the
+measurement pass rarely decode or read a line twice.
+"""
+
+from micropython import const
+from array import array
+
+LINE_CACHE_LINES = const(64)   # decoded lines per cache generation
+LINE_READ_AHEAD = const(16)    # lines decoded per file read
+LINE_READ_MAX = const(4096)    # bytes per file read (at least one line)
+
+
+def _decode(raw):
+    try:
+        return raw.decode()
+    except:
+        return ''.join([chr(b) if b < 128 else '?' for b in raw])
+
+
+class _Lines:
+    """Cached line sequence over an array of line start offsets.
+
+    Subclasses set _offs (line starts plus an end sentinel), _n and
+    size, and implement _read(i) and raw_lines().
+    """
+
+    def __init__(self):
+        self._young = {}
+        self._old = {}
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._n
+        s = self._young.get(i)
+        if s is not None:
+            return s
+        s = self._old.get(i)
+        if s is not None:
+            self._put(i, s)
+            return s
+        if i < 0 or i >= self._n:
+            raise IndexError
+        return self._read(i)
+
+    def __iter__(self):
+        for raw in self.raw_lines():
+            yield _decode(raw)
+
+    def _put(self, i, s):
+        if len(self._young) >= LINE_CACHE_LINES:
+            self._old = self._young
+            self._young = {}
+        self._young[i] = s
+
+    def close(self):
+        pass
+
+
+class PackedLines(_Lines):
+    """Document lines packed into one bytes buffer."""
+
+    def __init__(self, filename):
+        _Lines.__init__(self)
+        with open(filename, 'rb') as f:
+            buf = f.read()
+        offs = array('I')
+        size = 0
+        pos = 0
+        end = len(buf)
+        while pos < end:
+            offs.append(pos)
+            nl = buf.find(b'\n', pos)
+            nxt = end if nl < 0 else nl + 1
+            e = nxt
+            while e > pos and buf[e - 1] in (10, 13):
+                e -= 1
+            size += e - pos + 1
+            pos = nxt
+        offs.append(end)
+        self._buf = buf
+        self._offs = offs
+        self._n = len(offs) - 1
+        # Character count of the lines joined with '\n' (ASCII documents)
+        self.size = size - 1 if size else 0
+
+    def _line(self, i):
+        offs = self._offs
+        return self._buf[offs[i]:offs[i + 1]].rstrip(b'\r\n')
+
+    def _read(self, i):
+        s = _decode(self._line(i))
+        self._put(i, s)
+        return s
+
+    def raw_lines(self):
+        """Yield every line as bytes without line endings."""
+        for i in range(self._n):
+            yield self._line(i)
+
+
+class IndexedLines(_Lines):
+    """Document lines read on demand from a file via seek()."""
+
+    def __init__(self, filename):
+        _Lines.__init__(self)
+        self.filename = filename
+        offs = array('I')
+        size = 0
+        pos = 0
+        with open(filename, 'rb') as f:
+            for raw in f:
+                offs.append(pos)
+                pos += len(raw)
+                size += len(raw.rstrip(b'\r\n')) + 1
+        offs.append(pos)
+        self._offs = offs
+        self._n = len(offs) - 1
+        # Character count of the lines joined with '\n' (ASCII documents)
+        self.size = size - 1 if size else 0
+        self._f = open(filename, 'rb')
+
+    def raw_lines(self):
+        """Yield every line as bytes without line endings.
+
+        Reads the file sequentially and leaves the line cache alone.
+        """
+        with open(self.filename, 'rb') as f:
+            for raw in f:
+                yield raw.rstrip(b'\r\n')
+
+    def _read(self, i):
+        """Read and cache a block of lines starting at i; return line i."""
+        offs = self._offs
+        start = offs[i]
+        end = min(self._n, i + LINE_READ_AHEAD)
+        j = i + 1
+        while j < end and offs[j + 1] - start <= LINE_READ_MAX:
+            j += 1
+        f = self._f
+        f.seek(start)
+        buf = f.read(offs[j] - start)
+        first = None
+        for k in range(i, j):
+            s = _decode(buf[offs[k] - start:offs[k + 1] - start]
+                        .rstrip(b'\r\n'))
+            self._put(k, s)
+            if first is None:
+                first = s
+        return first
+
+    def close(self):
+        """Close the backing file."""
+        try:
+            self._f.close()
+        except:
+            pass
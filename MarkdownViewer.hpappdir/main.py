@@ -9,16 +9,20 @@ from keycodes import (KEY_UP, KEY_DOWN, KEY_ESC, KEY_PLUS,
     KEY_MINUS, KEY_BACKSPACE, KEY_LOG, KEY_F1, KEY_F2,
     KEY_F3, KEY_F4, KEY_F5, KEY_F6, KEY_LEFT, KEY_RIGHT)
 from markdown_viewer import MarkdownViewer
-from input_helpers import get_key, get_key_fast, get_touch, get_ticks, get_menu_tap, mouse_clear
+from input_helpers import (poll_input, get_menu_tap, mouse_clear,
+    PollPolicy)
 from ui import (draw_menu, draw_notch, is_notch_tap,
     save_menu_area, restore_menu_area,
-    show_search_input, show_context_menu, show_list_manager,
+    show_search_bar, show_context_menu, show_list_manager,
     show_stats_dialog, show_goto_dialog, show_shortcuts_overlay)
-from graphics import draw_text, text_width
+from graphics import draw_text, text_width, save_glyph_tables
 from browser import file_picker
 import theme
 import bookmarks
 import file_prefs
+import profiler
+import doc_cache
+import tasks
 
 VIEWER_MENU = ["Find", "Next", "Marks", "TOC", "More", "Theme"]
 BROWSER_MENU = ["Recent", "", "", "", "Help", "Theme"]
@@ -116,6 +120,19 @@ def _find_help_file():
     return 'help.md'
 
 
+def _match_count_label(viewer):
+    """Match count for display; '+' marks a search stopped at the limit.
+
+    'bad' is shown for an invalid regular expression.
+    """
+    if viewer.search_error:
+        return 'bad'
+    info = viewer.get_search_info()
+    if not info:
+        return '0'
+    return str(info[1]) + ('' if info[2] else '+')
+
+
 _search_pill_x = 320  # left edge of the search status pill
 
 
@@ -127,8 +144,7 @@ def _draw_search_status(viewer):
     _search_pill_x = 320
     sy = 227
     if info:
-        cur, total = info
-        label = str(cur) + ' of ' + str(total) + ' matches'
+        label = str(info[0]) + ' of ' + _match_count_label(viewer) + ' matches'
         tw = text_width(label, FONT_10)
         sw = tw + 8
         _search_pill_x = 320 - sw
@@ -163,6 +179,7 @@ def main():
     ppl_guard.init()
     theme.init()
     last_file, last_scroll = load_last_file()
+    tasks.add('prefs', file_prefs.flush_step)
 
     while True:
         filename = file_picker(
@@ -239,17 +256,23 @@ def main():
             menu_visible = True
 
         search_case = False
+        search_regex = False
 
         def do_search():
-            nonlocal menu_visible, search_case
+            nonlocal menu_visible, search_case, search_regex
             menu_visible = False
-            term, search_case = show_search_input(
-                case_sensitive=search_case, menu_y=MENU_Y)
+
+            def on_change(term, cs, rx):
+                viewer.search(term, case_sensitive=cs, regex=rx)
+                return _match_count_label(viewer)
+            term, search_case, search_regex = show_search_bar(
+                on_change, case_sensitive=search_case, regex=search_regex,
+                menu_y=MENU_Y)
             mouse_clear()
-            fillrect(0, 0, 0, 320, 240,
-                     theme.colors['bg'], theme.colors['bg'])
+            bg = theme.colors['bg']
+            fillrect(0, 0, MENU_Y, 320, 240 - MENU_Y, bg, bg)
             if term:
-                viewer.search(term, case_sensitive=search_case)
+                viewer.render()
             else:
                 viewer.clear_search()
             _draw_overlay()
@@ -323,34 +346,74 @@ def main():
             show_stats_dialog(filename, lines, words, mins, MENU_Y)
             redraw()
 
+        def _restore_scroll(v, name):
+            """Move a freshly loaded viewer to the saved position of name."""
+            saved_s = file_prefs.get_scroll_pos(name)
+            if saved_s > 0:
+                v.set_scroll_position(saved_s)
+
+        def _load_viewer(name):
+            """Load name into a new viewer, or return None on failure."""
+            v = MarkdownViewer(GR_AFF, height=VIEWER_HEIGHT_FULL)
+            if v.load_markdown_file(name):
+                _restore_scroll(v, name)
+                return v
+            v.close()
+            return None
+
+        def _switch_viewer(name):
+            """Park the current viewer and open name, reusing a parked one.
+
+            A parked viewer keeps its own position; the saved one is only
+            applied when name is loaded again.  Returns False, staying on
+            the current document, if name cannot be loaded.
+            """
+            nonlocal filename, viewer
+            # Take before parking: put() may evict the viewer we want
+            v = doc_cache.take(name)
+            if v is None:
+                v = _load_viewer(name)
+                if v is None:
+                    return False
+            elif split_mode:
+                # Also drops the strip contents drawn by another viewer
+                v.set_split_viewport(85, VIEWER_HEIGHT_FULL - 80)
+            else:
+                v.set_split_viewport(5, VIEWER_HEIGHT_FULL)
+            file_prefs.set_scroll_pos(filename, viewer.get_scroll_position())
+            doc_cache.put(filename, viewer)
+            filename = name
+            viewer = v
+            return True
+
         def navigate_link(url):
             """Open a .md link, pushing current file onto the back-stack."""
-            nonlocal filename, marks, viewer
+            nonlocal marks
             if not url.endswith('.md'):
                 return False
-            nav_stack.append((filename, viewer.get_scroll_position()))
+            here = (filename, viewer.get_scroll_position())
+            if not _switch_viewer(url):
+                return False
+            nav_stack.append(here)
             del fwd_stack[:]  # New direction clears forward history
-            filename = url
-            viewer = MarkdownViewer(GR_AFF, height=VIEWER_HEIGHT_FULL)
-            viewer.load_markdown_file(filename)
-            saved_s = file_prefs.get_scroll_pos(filename)
-            if saved_s > 0:
-                viewer.set_scroll_position(saved_s)
             marks = bookmarks.load(filename)
             viewer.set_bookmarks(marks)
             redraw()
             return True
 
         def navigate_back():
-            """Pop the back-stack, returning to the previous file."""
-            nonlocal filename, marks, viewer
+            """Pop the back-stack, returning to the previous file.
+
+            An entry whose file can no longer be loaded is dropped.
+            """
+            nonlocal marks
             if not nav_stack:
                 return False
-            fwd_stack.append((filename, viewer.get_scroll_position()))
+            here = (filename, viewer.get_scroll_position())
             prev_file, prev_scroll = nav_stack.pop()
-            filename = prev_file
-            viewer = MarkdownViewer(GR_AFF, height=VIEWER_HEIGHT_FULL)
-            viewer.load_markdown_file(filename)
+            if not _switch_viewer(prev_file):
+                return True
+            fwd_stack.append(here)
             viewer.set_scroll_position(prev_scroll)
             marks = bookmarks.load(filename)
             viewer.set_bookmarks(marks)
@@ -358,15 +421,18 @@ def main():
             return True
 
         def navigate_forward():
-            """Pop the forward-stack, going to the next file."""
-            nonlocal filename, marks, viewer
+            """Pop the forward-stack, going to the next file.
+
+            An entry whose file can no longer be loaded is dropped.
+            """
+            nonlocal marks
             if not fwd_stack:
                 return False
-            nav_stack.append((filename, viewer.get_scroll_position()))
+            here = (filename, viewer.get_scroll_position())
             next_file, next_scroll = fwd_stack.pop()
-            filename = next_file
-            viewer = MarkdownViewer(GR_AFF, height=VIEWER_HEIGHT_FULL)
-            viewer.load_markdown_file(filename)
+            if not _switch_viewer(next_file):
+                return True
+            nav_stack.append(here)
             viewer.set_scroll_position(next_scroll)
             marks = bookmarks.load(filename)
             viewer.set_bookmarks(marks)
@@ -420,8 +486,9 @@ def main():
             wrap_label = "Wrap: ON" if viewer.is_word_wrap() else "Wrap: OFF"
             font_label = "Font: " + viewer.get_font_label() + "px"
             split_label = "Split: ON" if split_mode else "Split: OFF"
+            prof_label = "Profile: ON" if profiler.enabled else "Profile: OFF"
             choices = [font_label, wrap_label, split_label,
-                       "Go to %", "Shortcuts", "Doc Info"]
+                       "Go to %", "Shortcuts", "Doc Info", prof_label]
             if fwd_stack:
                 choices.append("Forward \u25B6")
             choice = show_context_menu(160, 100, choices,
@@ -445,15 +512,41 @@ def main():
                 redraw()
             elif choice == 5:  # Doc Info
                 open_stats()
-            elif choice == 6 and fwd_stack:
+            elif choice == 6:  # Profiler
+                if profiler.enabled:
+                    profiler.dump(filename)
+                    profiler.disable()
+                else:
+                    profiler.enable()
+                redraw()
+            elif choice == 7 and fwd_stack:
                 navigate_forward()
             else:
                 redraw()
 
+        def _measure_task():
+            # Measure (then index) the rest of the document in chunks so
+            # the scrollbar and progress refine between polls.
+            if not viewer.measure_pending():
+                return False
+            if viewer.measure_step():
+                _draw_overlay()
+            return True
+
+        def _prefetch_task():
+            # Then load the .md files linked from the viewport.
+            return doc_cache.prefetch_step(viewer.get_visible_links(),
+                                           filename, _load_viewer)
+
+        tasks.add('measure', _measure_task)
+        tasks.add('prefetch', _prefetch_task)
+
+        poll = PollPolicy()
         try:
             while True:
-                key = get_key()
-                if key > 0:
+                profiler.frame()
+                key, tx, ty, now = poll_input(poll)
+                if key >= 0:
                     if menu_visible:
                         hide_menu()
                     if key == KEY_ESC:
@@ -490,7 +583,7 @@ def main():
                     elif key == KEY_F5:
                         open_more_menu()
                     elif key == KEY_F6:
-                        theme.toggle()
+                        viewer.toggle_theme(render=False)
                         redraw()
                     elif key == KEY_LEFT:
                         if not navigate_back():
@@ -499,14 +592,14 @@ def main():
                     elif key == KEY_RIGHT:
                         navigate_forward()
 
-                tx, ty = get_touch()
+                poll.update(key >= 0 or tx >= 0)
                 if tx >= 0 and ty >= 0:
                     if not touch_down:
                         touch_down = True
                         tap_x = tx
                         tap_y = ty
                         drag_last_y = ty
-                        touch_start_time = get_ticks()
+                        touch_start_time = now
                         long_press_fired = False
                         # Check if starting a scrollbar drag
                         if not menu_visible and viewer.is_scrollbar_tap(tx, ty):
@@ -528,7 +621,7 @@ def main():
                                     not menu_visible and
                                     moved_lp < DRAG_THRESHOLD * 3 and
                                     tap_y < MENU_Y):
-                                elapsed = get_ticks() - touch_start_time
+                                elapsed = now - touch_start_time
                                 if elapsed >= LONG_PRESS_MS:
                                     long_press_fired = True
                                     ctx_items = ["Add Bookmark",
@@ -587,7 +680,7 @@ def main():
                                         elif slot == 4:
                                             open_more_menu()
                                         elif slot == 5:
-                                            theme.toggle()
+                                            viewer.toggle_theme(render=False)
                                             menu_visible = False
                                             redraw()
                                     else:
@@ -623,6 +716,12 @@ def main():
                                                 _draw_overlay()
                                                 _draw_split_toc()
                         drag_last_y = -1
+
+                # Idle: hand the rest of the poll to background tasks,
+                # and skip the next sleep while they have work
+                poll.work = False
+                if key < 0 and not touch_down and not menu_visible:
+                    poll.work = tasks.run()
         except KeyboardInterrupt:
             action = 'exit'
 
@@ -631,6 +730,12 @@ def main():
         save_last_file(filename, last_scroll)
         file_prefs.set_scroll_pos(filename, last_scroll)
         file_prefs.set_progress(filename, viewer.get_progress_percent())
+        save_glyph_tables()
+        profiler.dump(filename)
+        tasks.remove('measure')
+        tasks.remove('prefetch')
+        viewer.close()
+        doc_cache.clear()
 
         if action == 'exit':
             return
@@ -641,5 +746,6 @@ try:
 except KeyboardInterrupt:
     pass
 finally:
+    file_prefs.flush()
     clear_screen()
     ppl_guard.cleanup()
@@ -1,11 +1,51 @@
 from graphics import (draw_text, draw_rectangle, text_width, draw_image,
-    open_file, blit, get_grob_size, get_formula_size, render_formula)
+    open_file, blit, get_grob_size, get_formula_size, render_formula,
+    begin_batch, end_batch, flush)
 from constants import (FONT_10, FONT_12, FONT_14,
     TABLE_MAX_COLS, TABLE_CELL_PAD, GR_TMP, GR_BACK, GR_AFF,
     TRANSPARENCY, SCROLLBAR_WIDTH, SCROLLBAR_MIN_THUMB,
-    BLOCKQUOTE_INDENT, BLOCKQUOTE_BAR_WIDTH, NESTED_LIST_INDENT)
+    BLOCKQUOTE_INDENT, BLOCKQUOTE_BAR_WIDTH, NESTED_LIST_INDENT,
+    MEASURE_CHUNK, MEASURE_LOOKAHEAD, GR_STRIP, STRIP_HEIGHT,
+    INDEXED_LOAD_BYTES, SEARCH_INDEX_CHUNK, SEARCH_MAX_MATCHES,
+    SEARCH_REGEX_MS, PREFETCH_FONTS, RECORD_CACHE_SIZE,
+    WRAP_CACHE_LINES)
+from hpprime import strblit2, dimgrob, fillrect
+from micropython import const
+from array import array
 import gc
 import theme
+import layout_cache
+from line_store import PackedLines, IndexedLines
+from search_index import SearchIndex, compile_pattern, fold_pattern
+from file_ops import get_file_size
+
+# Display-list ops.  Every op is a tuple starting with (code, x, dy, vh):
+# dy is relative to the Y of the record's first source line and vh is the
+# height used for the fully-in-view test when the op is replayed.
+# Colors are stored as theme keys so a theme switch needs no re-layout.
+_OP_RECT = const(0)      # + (w, h, edge_key, fill_key)
+_OP_TEXT = const(1)      # + (text, font, color_key, clip_w, w, lh, style)
+                         # and, with _ST_SEARCH, (src, line_idx)
+_OP_LINK = const(2)      # + (x2, h, url)
+_OP_HDR = const(3)       # + (x2, h, line_idx)
+_OP_FORMULA = const(4)   # + (expr, fw, fh)
+_OP_IMG_FILE = const(5)  # + (filename, dw, dh, img_w, img_h)
+_OP_IMG_B64 = const(6)   # + (line_idx,)
+_OP_RUN = const(7)       # _OP_TEXT fields + (spans, line_idx): several
+                         # words drawn as one string; spans holds
+                         # (start, end, dx, w, src) per word
+
+# _OP_TEXT style bits
+_ST_BOLD = const(1)      # faux-bold: draw a second time 1px to the right
+_ST_SEARCH = const(2)    # text maps to its source line: src is the line
+                         # offset of the op's (or word's) first character
+
+# _dlist entry for a source line folded into the previous line's record
+# (table rows, math fence bodies).
+_CONT = const(0)
+
+# Body fonts cycled by the viewer, with their line heights
+_FONTS = ((FONT_10, 12), (FONT_12, 14), (FONT_14, 16))
 
 
 class MarkdownViewer:
@@ -15,10 +55,17 @@ class MarkdownViewer:
         self.gr = gr
         self.height = height
         self.document = MarkdownDocument()
+        self._search_trail = []     # (term, case, matches, complete) per prefix
+        self.search_error = None    # message when the last search failed
+        self._idle_failed = False   # idle work ran out of memory
 
-    def load_markdown_file(self, filename):
+    def load_markdown_file(self, filename, indexed=None):
         """Load markdown content from a file."""
-        return self.document.load_file(filename)
+        return self.document.load_file(filename, indexed)
+
+    def close(self):
+        """Release resources held by the loaded document."""
+        self.document.close()
 
     def render(self):
         """Render the loaded markdown document."""
@@ -49,69 +96,140 @@ class MarkdownViewer:
     def scroll_to_bottom(self):
         self.document.scroll_to_bottom()
 
-    def toggle_theme(self):
-        """Toggle light/dark theme and re-render."""
+    def toggle_theme(self, render=True):
+        """Toggle light/dark theme and repaint from the existing layout.
+
+        Display-list records store theme color keys, so only the cached
+        pixels are dropped.  With render=False the caller repaints.
+        """
         theme.toggle()
         if self.document.renderer:
-            self.document.renderer._content_height = 0
-        self.document.render(self.gr)
+            self.document.renderer.invalidate_paint()
+        if render:
+            self.document.render(self.gr, height=self.height)
 
-    def search(self, term, case_sensitive=False):
-        """Search for term in the document."""
-        if not self.document.renderer:
+    def search(self, term, case_sensitive=False, regex=False):
+        """Search for term in the document and show the nearest match.
+
+        Matches come from the document's search index as (line, offset)
+        pairs.  When term extends the previous query, the previous
+        matches are narrowed instead of rescanning the document, unless
+        that query stopped at SEARCH_MAX_MATCHES; the results of shorter
+        queries are kept so deleting a character restores them.  An
+        empty term clears the search.  With regex=True, term is a regular expression
+        matched line by line within SEARCH_REGEX_MS; an invalid pattern
+        sets search_error.  Lines are measured only as far as the last
+        match.
+        """
+        doc = self.document
+        self.search_error = None
+        if not doc.renderer:
             return False
-        r = self.document.renderer
+        if not term:
+            self.clear_search()
+            return False
+        r = doc.renderer
+        t = term if case_sensitive else term.lower()
+        rx = None
+        trail = self._search_trail
+        if regex:
+            del trail[:]
+            try:
+                hits, complete = doc.search_index.find_regex(
+                    term, case_sensitive, SEARCH_MAX_MATCHES,
+                    SEARCH_REGEX_MS)
+                rx = compile_pattern(term if case_sensitive
+                                     else fold_pattern(term))
+            except:
+                self.search_error = 'bad pattern'
+                hits, complete = array('I'), True
+        else:
+            while trail and (trail[-1][1] != case_sensitive or
+                             not t.startswith(trail[-1][0])):
+                trail.pop()
+            if trail and trail[-1][0] == t:
+                hits, complete = trail[-1][2], trail[-1][3]
+            else:
+                # A capped result misses the matches past the cap, so
+                # only a complete one can be narrowed
+                if trail and trail[-1][3]:
+                    hits = doc.search_index.narrow(trail[-1][2], term,
+                                                   case_sensitive)
+                    complete = True
+                else:
+                    hits, complete = doc.search_index.find(
+                        term, case_sensitive, SEARCH_MAX_MATCHES)
+                trail.append((t, case_sensitive, hits, complete))
         r._search_case = case_sensitive
-        r._search_term = term if case_sensitive else (term.lower() if term else None)
-        r._search_positions = []
+        r._search_term = t
+        r._search_re = rx
+        r._search_hits = hits
+        r._search_complete = complete
         r._search_match_idx = 0
-        if not term:
-            self.document.render(self.gr)
+        r.invalidate_paint()    # repaint with the new highlights
+        if hits and hits[-2] >= len(r._line_y_cache):
+            r.measure_step(doc.lines,
+                           max_lines=hits[-2] + 1 - r._measure_next)
+        r._sync_search_positions()
+        if not hits:
+            doc.render(self.gr)
             return False
-        # Full render pass to collect match positions
-        saved_height = r._content_height
-        r._content_height = 0
-        self.document.render(self.gr)
-        r._content_height = saved_height if saved_height > 0 else r._content_height
-        if r._search_positions:
-            target = r._search_positions[0] - r.y
-            r.scroll_offset = max(0, target)
-            m = r._max_scroll()
-            if r.scroll_offset > m:
-                r.scroll_offset = m
-            self.document.render(self.gr)
-            return True
-        return False
+        # Start from the first match at or below the top of the view
+        ys = r._line_y_cache
+        idx = 0
+        for k in range(0, len(hits), 2):
+            if ys[hits[k]] >= r.scroll_offset:
+                idx = k // 2
+                break
+        self._show_match(idx)
+        return True
 
     def search_next(self):
         """Jump to next search match."""
-        if not self.document.renderer:
-            return
         r = self.document.renderer
-        if not r._search_positions:
+        if not r or not r._search_hits:
             return
-        r._search_match_idx = (r._search_match_idx + 1) % len(r._search_positions)
-        target = r._search_positions[r._search_match_idx] - r.y
-        r.scroll_offset = max(0, target)
-        m = r._max_scroll()
-        if r.scroll_offset > m:
-            r.scroll_offset = m
-        self.document.render(self.gr)
+        self._show_match((r._search_match_idx + 1) % (len(r._search_hits) // 2))
+
+    def _show_match(self, idx):
+        """Make search match idx current, scroll its line into view, render."""
+        doc = self.document
+        r = doc.renderer
+        r._search_match_idx = idx
+        li = r._search_hits[2 * idx]
+        if li >= len(r._line_y_cache):
+            r.measure_step(doc.lines, max_lines=li + 1 - r._measure_next)
+        y = r._line_y_cache[li]
+        if y < r.scroll_offset or y + r.line_height > r.scroll_offset + r.height:
+            r.scroll_offset = max(0, y)
+            m = r._max_scroll()
+            if r.scroll_offset > m:
+                r.scroll_offset = m
+        doc.render(self.gr)
 
     def get_search_info(self):
-        """Return (current_match_1based, total_matches) or None."""
+        """Return (current_match_1based, total_matches, complete) or None.
+
+        complete is False when the search stopped at SEARCH_MAX_MATCHES.
+        """
         if not self.document.renderer:
             return None
         r = self.document.renderer
-        if not r._search_term or not r._search_positions:
+        if not r._search_term or not r._search_hits:
             return None
-        return (r._search_match_idx + 1, len(r._search_positions))
+        return (r._search_match_idx + 1, len(r._search_hits) // 2,
+                r._search_complete)
 
     def clear_search(self):
         """Clear search highlighting."""
+        del self._search_trail[:]
         if self.document.renderer:
-            self.document.renderer._search_term = None
-            self.document.renderer._search_positions = []
+            r = self.document.renderer
+            r._search_term = None
+            r._search_re = None
+            r._search_hits = []
+            r._search_positions = []
+            r.invalidate_paint()
             self.document.render(self.gr)
 
     def get_scroll_position(self):
@@ -121,9 +239,8 @@ class MarkdownViewer:
         return 0
 
     def set_scroll_position(self, pos):
-        """Restore a saved scroll offset."""
-        if self.document.renderer:
-            self.document.renderer.scroll_offset = pos
+        """Restore a saved scroll offset, also before the first render."""
+        self.document.ensure_renderer(height=self.height).scroll_offset = pos
 
     def is_scrollbar_tap(self, x, y):
         """Check if a tap at (x,y) is on the scrollbar.
@@ -187,60 +304,98 @@ class MarkdownViewer:
         return 0
 
     def get_headers(self):
-        """Extract table of contents from the document.
+        """Return the table of contents of the document.
 
-        Returns list of (level, title, line_index) tuples.
+        Returns list of (level, title, line_index) tuples, built once
+        per document.
         """
-        if not self.document.lines:
-            return []
-        headers = []
-        for i, line in enumerate(self.document.lines):
-            stripped = line.strip()
-            if stripped.startswith('#'):
-                level = 0
-                while level < len(stripped) and stripped[level] == '#':
-                    level += 1
-                if level > 6:
-                    level = 6
-                title = stripped[level:].strip()
-                if title:
-                    headers.append((level, title, i))
-        return headers
+        return self.document.get_outline()
 
     def scroll_to_line(self, line_index):
         """Scroll so that the given source line index is visible.
 
-        Uses the cached per-line Y offsets for exact positioning.
-        Falls back to a measurement pass if the cache is not yet built.
+        Uses the cached per-line Y offsets for exact positioning,
+        measuring ahead first if the layout has not reached the line.
         """
         if not self.document.renderer or not self.document.lines:
             return
         r = self.document.renderer
-
-        # Use cached offsets if available
-        if r._line_y_cache and line_index < len(r._line_y_cache):
-            r.scroll_offset = max(0, r._line_y_cache[line_index])
+        lines = self.document.lines
+        if not r._measure_done and line_index >= len(r._line_y_cache):
+            r.measure_step(lines, max_lines=line_index + 1 - r._measure_next)
+        cache = r._line_y_cache
+        if line_index < len(cache):
+            r.scroll_offset = max(0, cache[line_index])
             m = r._max_scroll()
             if r.scroll_offset > m:
                 r.scroll_offset = m
-            self.document.render(self.gr, height=self.height)
-            return
-
-        # Cache not built yet — trigger a measurement pass
-        saved_scroll = r.scroll_offset
-        r.scroll_offset = 0
-        r._content_height = 0
         self.document.render(self.gr, height=self.height)
 
-        # Now use the freshly built cache
-        if r._line_y_cache and line_index < len(r._line_y_cache):
-            r.scroll_offset = max(0, r._line_y_cache[line_index])
+    def measure_pending(self):
+        """Return True while the layout or the search index is incomplete."""
+        r = self.document.renderer
+        if r is None or self._idle_failed:
+            return False
+        return not (r._measure_done and
+                                      self.document.search_index.done() and
+                                      not r.prefetch_pending())
+
+    def measure_step(self):
+        """Measure or index the next chunk of the document during idle time.
+
+        Layout comes first and redraws the scrollbar so it tracks the
+        refined content height; returns True when it did so.  Then the
+        search index is filled, then the layouts of the other body fonts.
+
+        On MemoryError the interrupted step is undone and idle work
+        stops for this document; scrolling still lays out what it shows.
+        """
+        d = self.document
+        r = d.renderer
+        if r is None:
+            return False
+        try:
+            if r._measure_done:
+                if d.search_index.build_step(SEARCH_INDEX_CHUNK):
+                    r.prefetch_step(d.lines)
+                return False
+            s = r.scroll_offset
+            r.measure_step(d.lines, max_lines=MEASURE_CHUNK)
+        except MemoryError:
+            self._idle_failed = True
+            r.abort_measure(d.lines)
+            if not d.search_index.done():
+                # A half-built index is rebuilt by the next search
+                d.search_index = SearchIndex(d.lines)
+            gc.collect()
+            return False
+        if r.scroll_offset != s:
+            # The finished layout ends above the view: redraw it all
+            self.render()
         else:
-            r.scroll_offset = saved_scroll
-        m = r._max_scroll()
-        if r.scroll_offset > m:
-            r.scroll_offset = m
-        self.document.render(self.gr, height=self.height)
+            d.refresh_scrollbar()
+        return True
+
+    def preload_step(self):
+        """Lay out the next chunk of a document that is not on screen.
+
+        Used to prefetch linked documents; nothing is drawn.  Returns
+        True once the layout is complete.
+        """
+        d = self.document
+        r = d.ensure_renderer(height=self.height)
+        return r.measure_step(d.lines, max_lines=MEASURE_CHUNK)
+
+    def get_visible_links(self):
+        """Return the .md link targets in the viewport, top to bottom."""
+        r = self.document.renderer
+        out = []
+        if r:
+            for zone in r._link_zones:
+                url = zone[4]
+                if url.endswith('.md') and url not in out:
+                    out.append(url)
+        return out
 
     def get_link_at(self, tx, ty):
         """Return the URL of a link at screen coordinates, or None."""
@@ -262,17 +417,22 @@ class MarkdownViewer:
         return min(100, int(r.scroll_offset * 100 / m))
 
     def cycle_font(self):
-        """Cycle body font through 10px, 12px, 14px."""
+        """Cycle body font through 10px, 12px, 14px.
+
+        Layouts of fonts already used (or laid out during idle time)
+        are reused, and the reading position is kept by source line.
+        """
         if not self.document.renderer:
             return
         r = self.document.renderer
-        fonts = [FONT_10, FONT_12, FONT_14]
-        heights = [12, 14, 16]
-        idx = fonts.index(r._body_font) if r._body_font in fonts else 0
-        idx = (idx + 1) % 3
-        r._body_font = fonts[idx]
-        r.line_height = heights[idx]
-        r._content_height = 0
+        idx = 0
+        for k in range(len(_FONTS)):
+            if _FONTS[k][0] == r._body_font:
+                idx = (k + 1) % len(_FONTS)
+        font, lh = _FONTS[idx]
+        anchor = r.line_anchor()
+        r.set_layout_options(font, lh, r._word_wrap, r.width)
+        r.scroll_to_anchor(self.document.lines, anchor)
         self.document.render(self.gr, height=self.height)
 
     def get_font_label(self):
@@ -287,8 +447,10 @@ class MarkdownViewer:
         if not self.document.renderer:
             return
         r = self.document.renderer
-        r._word_wrap = not r._word_wrap
-        r._content_height = 0
+        anchor = r.line_anchor()
+        r.set_layout_options(r._body_font, r.line_height, not r._word_wrap,
+                             r.width)
+        r.scroll_to_anchor(self.document.lines, anchor)
         self.document.render(self.gr, height=self.height)
 
     def is_word_wrap(self):
@@ -304,11 +466,7 @@ class MarkdownViewer:
         r = self.document.renderer
         for x1, y1, x2, y2, line_idx in r._header_zones:
             if x1 <= tx <= x2 and y1 <= ty <= y2:
-                if line_idx in r._collapsed_headers:
-                    r._collapsed_headers.discard(line_idx)
-                else:
-                    r._collapsed_headers.add(line_idx)
-                r._content_height = 0
+                r.toggle_collapse(self.document.lines, line_idx)
                 self.document.render(self.gr, height=self.height)
                 return True
         return False
@@ -335,25 +493,33 @@ class MarkdownViewer:
         return None
 
     def set_split_viewport(self, y, height):
-        """Set the renderer viewport for split-view mode."""
+        """Set the renderer viewport for split-view mode (paint-only)."""
         if self.document.renderer:
-            r = self.document.renderer
-            r.y = y
-            r.height = height
-            r._content_height = 0
+            self.document.renderer.set_viewport(y, height)
 
     def get_current_header_idx(self):
-        """Return index of the header nearest to current scroll position."""
+        """Return index of the last header at or above the scroll position.
+
+        Binary search over the header line Y offsets; headers not yet
+        measured are treated as below the viewport.
+        """
         headers = self.get_headers()
         if not headers or not self.document.renderer:
             return 0
         r = self.document.renderer
-        best = 0
-        for i, (_, _, line_idx) in enumerate(headers):
-            if r._line_y_cache and line_idx < len(r._line_y_cache):
-                if r._line_y_cache[line_idx] <= r.scroll_offset:
-                    best = i
-        return best
+        ys = r._line_y_cache
+        n = len(ys)
+        target = r.scroll_offset
+        lo = 0
+        hi = len(headers)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            li = headers[mid][2]
+            if li < n and ys[li] <= target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo - 1 if lo else 0
 
     def get_document_stats(self):
         """Return (line_count, word_count, read_time_min) for the document."""
@@ -398,43 +564,74 @@ class MarkdownRenderer:
         self._blockquote_depth = 0
         self._search_term = None
         self._search_case = False
-        self._search_positions = []
+        self._search_re = None      # compiled pattern in regex mode
+        self._search_hits = []      # flat (line, char offset) match pairs
+        self._search_complete = True
+        self._search_positions = [] # Y of each matching line (plus self.y)
         self._search_match_idx = 0
+        self._hl_cache = {}         # line -> match (start, end) pairs
         self._bookmarks = []
         self._link_zones = []  # [(x1, y1, x2, y2, url)] for tap detection
         self._header_zones = []  # [(x1, y1, x2, y2, line_idx)] for collapse taps
         self._line_y_cache = []     # abs Y offset per source line
         self._line_fence_cache = [] # code-fence state per source line
+        self._dlist = []            # display-list record per source line
+        self._rec_young = set()     # lines whose compiled records are
+        self._rec_old = set()       # kept, see _keep_record
+        self._ops = None            # record being filled while measuring
+        self._rec_y = 0             # abs Y of that record's first line
+        self._rec_line = -1         # source line currently being laid out
+        self._src_line = ''         # its text, for op source offsets
+        self._rec_start = -1        # first line of the open record
+        self._measure_next = 0      # next line for the resumable layout
+        self._measure_y = 0         # layout Y where measuring resumes
+        self._measure_done = False  # True once every line is measured
+        self._skip_lines = None     # lines hidden by collapsed headers
+        self.on_measured = None     # called once a full pass completes
+        self.use_strip = False      # serve the viewport from GR_STRIP
+        self._strip_top = 0         # abs Y of strip row 0
+        self._strip_i0 = -1         # first record drawn in the strip
+        self._strip_i1 = -1         # line after the last drawn record
+        self._strip_dark = False    # theme the strip was drawn with
         self._in_math_fence = False
         self._math_buffer = []
         self._formula_cache = {}    # expr -> (width, height)
+        self._wrap_cache = {}       # line -> word positions, see _wrap_breaks
+        self._wrap_old = {}         # previous generation of _wrap_cache
+        self._layouts = {}          # body font -> finished layout, see
+                                    # _stash_layout
+        self._layouts_src = None    # lines those layouts belong to
+        self._prefetch = None       # background layout in progress
+        self.prefetch_fonts = PREFETCH_FONTS
         self._body_font = FONT_10
         self._word_wrap = True
         self._collapsed_headers = set()
+        self._sections = None       # header line -> (section end, level)
+        self._sections_src = None   # lines the section tree was built from
         self._render_count = 0
 
-    def _in_view(self, y, h=12):
-        """Check if a line at y with height h is within the visible area."""
-        return y >= self.y and y + h <= self.y + self.height
-
     def _find_first_visible(self):
-        """Binary search for the first source line that could be visible.
+        """Binary search for the first record that could be visible.
 
-        Returns the index into _line_y_cache of the first line whose
-        absolute Y is within a margin above the current scroll offset.
+        Returns the index of the last source line starting at or above
+        the current scroll offset, backed up to the start of the
+        display-list record that contains it.
         """
-        target = self.scroll_offset - 50
-        if target <= 0:
-            return 0
+        target = self.scroll_offset
         cache = self._line_y_cache
+        if target <= 0 or not cache:
+            return 0
         lo = 0
         hi = len(cache) - 1
         while lo < hi:
-            mid = (lo + hi) // 2
-            if cache[mid] < target:
-                lo = mid + 1
+            mid = (lo + hi + 1) // 2
+            if cache[mid] <= target:
+                lo = mid
             else:
-                hi = mid
+                hi = mid - 1
+        dl = self._dlist
+        while lo > 0 and dl[lo] is _CONT:
+            lo -= 1
         return lo
 
     def clear(self):
@@ -448,9 +645,12 @@ class MarkdownRenderer:
     def render(self, lines):
         """Render pre-split lines to the graphics buffer.
 
-        First render (content_height==0) does a full measurement pass,
-        building a per-line Y-offset cache.  Subsequent renders use
-        the cache to skip lines above the viewport (partial render).
+        Layout is incremental: the measurement pass lays out lines into
+        a display list of positioned draw records and a per-line Y-offset
+        cache, but only as far as the viewport plus a small lookahead.
+        The rest is measured in chunks by measure_step() while the app
+        is idle.  Every render then replays only the records that
+        intersect the viewport.
 
         Args:
             lines: list of strings (pre-split document lines).
@@ -461,134 +661,988 @@ class MarkdownRenderer:
         if self._render_count % 8 == 0:
             gc.collect()
 
-        self.clear()
-        self.current_y = self.y - self.scroll_offset
+        if self._layouts_src is not lines:
+            self._drop_layouts()
+            self._layouts_src = lines
+        if self._measure_done and len(self._dlist) != len(lines):
+            self.invalidate_layout()
+        if not self._measure_done:
+            self.measure_step(lines, self.scroll_offset + self.height
+                              + MEASURE_LOOKAHEAD)
+        self._clamp_scroll()
+
+        del self._link_zones[:]
+        del self._header_zones[:]
+        # Queue the frame's PPL drawing commands into a few joined evals
+        begin_batch()
+        if self.use_strip and self._strip_paint(lines):
+            self._replay(lines, None)
+        else:
+            self.clear()
+            self._replay(lines, self.gr)
+        self._draw_scrollbar()
+        end_batch()
+
+    def invalidate_paint(self):
+        """Drop the cached pixels; the next render redraws from the layout.
+
+        For inputs that change no geometry: colors, search highlights.
+        """
+        self._strip_i0 = -1
+        self._hl_cache = {}
+
+    def set_viewport(self, y, height):
+        """Move or resize the viewport without touching the layout.
+
+        Layout Y offsets are relative to the content top, so only the
+        screen-relative search positions and the scroll range change.
+        """
+        self.y = y
+        self.height = height
+        self._clamp_scroll()
+        if self._search_hits:
+            self._sync_search_positions()
+        self.invalidate_paint()
+
+    def set_layout_options(self, body_font, line_height, word_wrap, width):
+        """Change the inputs that affect layout geometry.
+
+        Drops the layout and the wrap cache only if one of them
+        changed.  On a body font change the finished layout is kept for
+        later and a kept layout of the new font is adopted instead of
+        measuring.  Returns True if the inputs changed.
+        """
+        if (body_font == self._body_font and line_height == self.line_height
+                and word_wrap == self._word_wrap and width == self.width):
+            return False
+        if word_wrap != self._word_wrap or width != self.width:
+            self._drop_layouts()
+        else:
+            self._stash_layout()
+        self._body_font = body_font
+        self.line_height = line_height
+        self._word_wrap = word_wrap
+        self.width = width
+        self._wrap_cache = {}
+        self._wrap_old = {}
+        self.invalidate_layout()
+        if self._prefetch and self._prefetch[0] == body_font:
+            self._prefetch = None
+        lay = self._layouts.pop(body_font, None)
+        if lay:
+            self.adopt_layout(lay[0], lay[1], lay[2], lay[3], {})
+        return True
+
+    def _stash_layout(self):
+        """Keep the finished layout of the current body font.
+
+        Stored like the sidecar: content height, line Y offsets, fence
+        states and record boundaries; records are compiled again lazily
+        when the layout is adopted.
+        """
+        if not self._measure_done or not self._line_y_cache:
+            return
+        conts = bytearray(len(self._dlist))
+        k = 0
+        for e in self._dlist:
+            if e is _CONT:
+                conts[k] = 1
+            k += 1
+        self._layouts[self._body_font] = (
+            self._content_height, self._line_y_cache,
+            bytearray(self._line_fence_cache), conts)
+
+    def _drop_layouts(self):
+        """Forget kept and background layouts (the geometry changed)."""
+        self._layouts.clear()
+        self._prefetch = None
+
+    def prefetch_pending(self):
+        """Return True while another body font still has to be laid out."""
+        if not self.prefetch_fonts or not self._measure_done:
+            return False
+        for font, _ in _FONTS:
+            if font != self._body_font and font not in self._layouts:
+                return True
+        return False
+
+    def prefetch_step(self, lines):
+        """Lay out the next chunk of another body font's layout.
+
+        The current layout is swapped out for the step.  Chunks end at
+        record boundaries, and only record boundaries are kept, not the
+        records, so a background layout stays as small as a sidecar.
+        Returns True when a chunk was laid out.
+        """
+        if not self.prefetch_pending():
+            return False
+        pf = self._prefetch
+        if pf is None:
+            for font, lh in _FONTS:
+                if font != self._body_font and font not in self._layouts:
+                    break
+            # font, line height, ys, fences, records, next line, next Y,
+            # content height, code fence state
+            pf = [font, lh, [], [], [], 0, 0, 0, False, '']
+            self._prefetch = pf
+        fg = (self._body_font, self.line_height, self._line_y_cache,
+              self._line_fence_cache, self._dlist, self._content_height,
+              self._measure_next, self._measure_y, self._wrap_cache,
+              self.on_measured, self._strip_i0, self._rec_young,
+              self._rec_old, self._wrap_old)
+        self._body_font = pf[0]
+        self.line_height = pf[1]
+        self._line_y_cache = pf[2]
+        self._line_fence_cache = pf[3]
+        self._dlist = dl = pf[4]
+        self._measure_next = pf[5]
+        self._measure_y = pf[6]
+        self._content_height = pf[7]
+        self._in_code_fence = pf[8]
+        self._code_lang = pf[9]
+        self._measure_done = False
+        self._rec_start = -1
+        self._wrap_cache = {}
+        self._wrap_old = {}
+        self._rec_young = set()
+        self._rec_old = set()
+        self.on_measured = None
+        start = len(dl)
+        ok = True
+        try:
+            # until_y stops at a record boundary, so no block is left open
+            self.measure_step(lines, until_y=self._measure_y
+                              + MEASURE_CHUNK * pf[1])
+        except MemoryError:
+            ok = False
+        done = self._measure_done
+        dl = self._dlist
+        for i in range(start, len(dl)):
+            if dl[i] is not _CONT:
+                dl[i] = None
+        pf[2] = self._line_y_cache
+        pf[3] = self._line_fence_cache
+        pf[4] = dl
+        pf[5] = self._measure_next
+        pf[6] = self._measure_y
+        pf[7] = self._content_height
+        pf[8] = self._in_code_fence
+        pf[9] = self._code_lang
+        (self._body_font, self.line_height, self._line_y_cache,
+         self._line_fence_cache, self._dlist, self._content_height,
+         self._measure_next, self._measure_y, self._wrap_cache,
+         self.on_measured, self._strip_i0, self._rec_young,
+         self._rec_old, self._wrap_old) = fg
+        self._measure_done = True
+        self._rec_start = -1
+        self._ops = None
+        self._in_code_fence = False
+        self._in_math_fence = False
+        del self._table_buffer[:]
+        if self._search_hits:
+            self._sync_search_positions()
+        if not ok:
+            self._drop_layouts()
+            self.prefetch_fonts = False
+            gc.collect()
+            return False
+        if done:
+            conts = bytearray(len(dl))
+            for i in range(len(dl)):
+                if dl[i] is _CONT:
+                    conts[i] = 1
+            self._layouts[pf[0]] = (pf[7], pf[2], bytearray(pf[3]), conts)
+            self._prefetch = None
+        return True
+
+    def _line_at(self, y):
+        """Return the last measured line starting at or above layout y."""
+        cache = self._line_y_cache
+        lo = 0
+        hi = len(cache) - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if cache[mid] <= y:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+    def _line_span(self, i):
+        """Return (top, bottom) layout Y of source line i."""
+        ys = self._line_y_cache
+        y0 = ys[i]
+        return (y0, ys[i + 1] if i + 1 < len(ys) else self._content_height)
+
+    def line_anchor(self):
+        """Return (line, per-mille into it) at the top of the viewport."""
+        if not self._line_y_cache:
+            return (0, 0)
+        i = self._line_at(self.scroll_offset)
+        y0, y1 = self._line_span(i)
+        if y1 <= y0:
+            return (i, 0)
+        h = y1 - y0
+        return (i, ((self.scroll_offset - y0) * 1000 + h // 2) // h)
+
+    def scroll_to_anchor(self, lines, anchor):
+        """Scroll to a line_anchor() position in the current layout."""
+        i, frac = anchor
+        if not self._measure_done and i + 1 >= len(self._line_y_cache):
+            self.measure_step(lines, max_lines=i + 2 - self._measure_next)
+        if i >= len(self._line_y_cache):
+            return
+        y0, y1 = self._line_span(i)
+        s = y0 + ((y1 - y0) * frac + 500) // 1000
+        m = self._max_scroll()
+        self.scroll_offset = s if s < m else m
+
+    def invalidate_layout(self):
+        """Drop the layout so the next render measures from the top.
+
+        For inputs that change geometry: body font, word wrap, width,
+        collapsed sections (see set_layout_options and _relayout).
+        """
+        self._content_height = 0
+        self._line_y_cache = []
+        self._line_fence_cache = []
+        self._dlist = []
+        self._rec_young = set()
+        self._rec_old = set()
+        self._ops = None
+        self._rec_start = -1
+        self._measure_next = 0
+        self._measure_y = 0
+        self._measure_done = False
+        self.invalidate_paint()
+
+    def _begin_measure(self, lines):
+        """Reset block state before laying out the first line."""
+        self.invalidate_layout()
         del self._table_buffer[:]
         self._in_code_fence = False
         self._in_math_fence = False
         del self._math_buffer[:]
         self._blockquote_depth = 0
-        del self._link_zones[:]
-        del self._header_zones[:]
 
-        n = len(lines)
-        is_measuring = self._content_height == 0
+        # Compute lines to skip due to collapsed headers
+        self._skip_lines = self._compute_skip_lines(lines)
 
-        # Only rebuild search positions during measurement pass
-        if self._search_term and is_measuring:
-            self._search_positions = []
+    def measure_step(self, lines, until_y=-1, max_lines=0):
+        """Continue the resumable layout pass.
 
-        # Compute lines to skip due to collapsed headers
-        skip_lines = self._compute_skip_lines(lines)
-
-        if is_measuring:
-            # --- Full measurement pass: build cache ---
-            cache_y = []
-            cache_f = []
-            for _li, line in enumerate(lines):
-                cache_y.append(
-                    self.current_y + self.scroll_offset - self.y)
-                # Fence state: 0=none, 1=code, 2=math
-                if self._in_math_fence:
-                    cache_f.append(2)
-                elif self._in_code_fence:
-                    cache_f.append(1)
-                else:
-                    cache_f.append(0)
-                if skip_lines and _li in skip_lines:
-                    # Track fence state for skipped lines
-                    stripped = line.strip()
-                    if stripped.startswith('```'):
-                        if self._in_math_fence:
-                            self._in_math_fence = False
-                        elif self._in_code_fence:
-                            self._in_code_fence = False
-                        else:
-                            tag = stripped[3:].strip().lower()
-                            if tag in ('math', 'formula', 'cas'):
-                                self._in_math_fence = True
-                            else:
-                                self._in_code_fence = True
-                    continue
-                self._render_line(line, _li)
-                # Periodically collect garbage during large documents
-                if _li % 80 == 79:
-                    gc.collect()
-            if self._table_buffer:
-                self._flush_table()
-            self._content_height = (
-                self.current_y + self.scroll_offset - self.y)
-            self._line_y_cache = cache_y
-            self._line_fence_cache = cache_f
-        elif self._line_y_cache and len(self._line_y_cache) == n:
-            # --- Cached partial render: skip above viewport ---
-            start_idx = self._find_first_visible()
-            # Back up into any table block that straddles the edge
-            while (start_idx > 0
-                    and lines[start_idx - 1].strip().startswith('|')):
-                start_idx -= 1
-            # Back up into any math fence block that straddles the edge
-            if (start_idx < n
-                    and self._line_fence_cache[start_idx] == 2):
-                while (start_idx > 0
-                        and self._line_fence_cache[start_idx] == 2):
-                    start_idx -= 1
-            # Restore rendering state from cache
-            if start_idx > 0:
-                state = self._line_fence_cache[start_idx]
-                self._in_code_fence = (state == 1)
-                self._in_math_fence = (state == 2)
-                self.current_y = (
-                    self.y + self._line_y_cache[start_idx]
-                    - self.scroll_offset)
-            for i in range(start_idx, n):
-                if self.current_y > self.y + self.height:
+        Lays out lines from where the previous call stopped until the
+        layout passes until_y at a record boundary, max_lines lines have
+        been laid out, or the document ends.  While incomplete,
+        _content_height is extrapolated from the measured prefix.
+        Returns True once the whole document is measured.
+        """
+        if self._measure_done:
+            return True
+        if self._measure_next == 0:
+            self._begin_measure(lines)
+        n = len(lines)
+        li = self._measure_next
+        stop = n
+        if max_lines > 0 and li + max_lines < n:
+            stop = li + max_lines
+        cache_y = self._line_y_cache
+        cache_f = self._line_fence_cache
+        dl = self._dlist
+        skip_lines = self._skip_lines
+        rec_start = self._rec_start
+        self.current_y = self._measure_y
+        while li < stop:
+            # Pending table rows and math bodies are laid out when the
+            # block closes, so they share the record of their first line.
+            pending = self._table_buffer or self._in_math_fence
+            if not pending:
+                if rec_start >= 0:
+                    self._keep_record(rec_start, tuple(self._ops))
+                    rec_start = -1
+                if until_y >= 0 and self.current_y > until_y:
                     break
-                if skip_lines and i in skip_lines:
-                    continue
-                self._render_line(lines[i], i)
+            cache_y.append(self.current_y)
+            # Fence state: 0=none, 1=code, 2=math
+            if self._in_math_fence:
+                cache_f.append(2)
+            elif self._in_code_fence:
+                cache_f.append(1)
+            else:
+                cache_f.append(0)
+            if pending:
+                dl.append(_CONT)
+            else:
+                rec_start = li
+                self._ops = []
+                self._rec_y = self.current_y
+                dl.append(None)
+            self._rec_line = li
+            line = lines[li]
+            if skip_lines and li in skip_lines:
+                self._track_fence(line)
+            else:
+                self._render_line(line, li)
+            li += 1
+            # Periodically collect garbage during large documents
+            if li % 80 == 0:
+                gc.collect()
+        self._measure_next = li
+        if li >= n:
             if self._table_buffer:
                 self._flush_table()
+            if rec_start >= 0:
+                self._keep_record(rec_start, tuple(self._ops))
+            rec_start = -1
+            self._ops = None
+            self._measure_done = True
+            self._content_height = self.current_y
+            self._clamp_scroll()
+            if self._search_hits:
+                self._sync_search_positions()
+            if self.on_measured:
+                self.on_measured()
+        elif li > 0:
+            self._content_height = self.current_y * n // li
+        self._rec_start = rec_start
+        self._measure_y = self.current_y
+        return self._measure_done
+
+    def abort_measure(self, lines):
+        """Undo a measure_step() that raised part way (MemoryError).
+
+        Cuts the layout back to the start of the record being laid out
+        and drops the compiled records and kept layouts to free memory;
+        measuring resumes from there on the next call.
+        """
+        self._drop_layouts()
+        self.prefetch_fonts = False
+        dl = self._dlist
+        for i in range(len(dl)):
+            if dl[i] is not _CONT:
+                dl[i] = None
+        self._rec_young = set()
+        self._rec_old = set()
+        del self._math_buffer[:]
+        if self._measure_done:
+            return
+        # The step may have stopped between the per-line appends
+        n = min(len(self._line_y_cache), len(self._line_fence_cache),
+                len(dl))
+        if n:
+            self._relayout(lines, n - 1, n)
         else:
-            # --- Fallback: no cache, content_height known ---
-            for _i, line in enumerate(lines):
-                if self.current_y > self.y + self.height:
-                    break
-                if skip_lines and _i in skip_lines:
-                    continue
-                self._render_line(line, _i)
-            if self._table_buffer:
-                self._flush_table()
+            self.invalidate_layout()
 
-        self._draw_scrollbar()
+    def adopt_layout(self, height, ys, fences, conts, formulas):
+        """Install a saved layout in place of a measurement pass.
+
+        Display-list records are compiled lazily from the cached Y and
+        fence state the first time they scroll into view.
+        """
+        self.invalidate_layout()
+        self._line_y_cache = ys
+        self._line_fence_cache = fences
+        self._dlist = [_CONT if c else None for c in conts]
+        self._formula_cache.update(formulas)
+        self._content_height = height
+        self._measure_next = len(ys)
+        self._measure_y = height
+        self._measure_done = True
+        if self._search_hits:
+            self._sync_search_positions()
+
+    def toggle_collapse(self, lines, line_idx):
+        """Collapse or expand the section under the header at line_idx.
+
+        Only the header's record and the section are laid out again;
+        the measured layout below is shifted by the change in height.
+        """
+        end = self._section_tree(lines).get(line_idx, (line_idx + 1, 0))[0]
+        self._drop_layouts()
+        if line_idx in self._collapsed_headers:
+            self._collapsed_headers.discard(line_idx)
+        else:
+            self._collapsed_headers.add(line_idx)
+        self._skip_lines = self._compute_skip_lines(lines)
+        if line_idx < len(self._line_y_cache):
+            self._relayout(lines, line_idx, end)
+
+    def _relayout(self, lines, a, b):
+        """Lay out lines a..b again, keeping the measured layout below.
+
+        Starts at the record holding line a and stops at the first line
+        at or after b where both the old and the new layout start a
+        record; Y offsets from there on are shifted by the change in
+        height instead of being measured again.  An unfinished layout
+        is cut back to line a and resumes from there.
+        """
+        ys = self._line_y_cache
+        fc = self._line_fence_cache
+        dl = self._dlist
+        while a > 0 and dl[a] is _CONT:
+            a -= 1
+        done = self._measure_done
+        height = self._content_height
+        n = len(ys)
+        self._set_fence_state(lines, a, fc[a])
+        self._line_y_cache = ys[:a]
+        self._line_fence_cache = fc[:a]
+        self._dlist = dl[:a]
+        del self._table_buffer[:]
+        self._ops = None
+        self._rec_start = -1
+        self._measure_next = a
+        self._measure_y = ys[a]
+        self._measure_done = False
+        self.invalidate_paint()
+        if not done:
+            return
+        # No sidecar write for an intermediate layout
+        on_measured = self.on_measured
+        self.on_measured = None
+        step = b - a if b > a else 1
+        k = a
+        while not self.measure_step(lines, max_lines=step):
+            step = 1
+            k = self._measure_next
+            if (k >= b and dl[k] is not _CONT and not self._table_buffer
+                    and not self._in_math_fence):
+                break
+        self.on_measured = on_measured
+        self._in_code_fence = False
+        if self._measure_done:
+            return
+        if self._rec_start >= 0:
+            self._keep_record(self._rec_start, tuple(self._ops))
+        self._ops = None
+        self._rec_start = -1
+        delta = self._measure_y - ys[k]
+        new_ys = self._line_y_cache
+        for i in range(k, n):
+            new_ys.append(ys[i] + delta)
+        self._line_fence_cache.extend(fc[k:])
+        self._dlist.extend(dl[k:])
+        self._measure_next = n
+        self._measure_y = self._content_height = height + delta
+        self._measure_done = True
+        if self._search_hits:
+            self._sync_search_positions()
+
+    def _sync_search_positions(self):
+        """Map the matching source lines to Y positions in the layout."""
+        ys = self._line_y_cache
+        hits = self._search_hits
+        n = len(ys)
+        pos = []
+        last = -1
+        for k in range(0, len(hits), 2):
+            i = hits[k]
+            if i >= n:
+                break
+            y = ys[i] + self.y
+            if y != last:
+                pos.append(y)
+                last = y
+        self._search_positions = pos
+
+    def _set_fence_state(self, lines, i, fence):
+        """Restore the fence state for a record starting at line i."""
+        self._in_code_fence = fence == 1
+        self._in_math_fence = False
+        if fence == 1:
+            # Find the opening fence for the code language tag
+            k = i
+            while k > 0 and self._line_fence_cache[k] == 1:
+                k -= 1
+            self._code_lang = lines[k].strip()[3:].strip().lower()
+
+    def _keep_record(self, i, rec):
+        """Store the compiled record of line i, bounding how many are kept.
+
+        Records live in two generations of RECORD_CACHE_SIZE lines (the
+        scheme of the text width cache).  When the young generation
+        fills up, the records of the old one go back to None and are
+        compiled again when they next scroll into view, so a fully
+        measured document keeps only its boundaries and Y offsets.
+        """
+        young = self._rec_young
+        if len(young) >= RECORD_CACHE_SIZE:
+            dl = self._dlist
+            n = len(dl)
+            for j in self._rec_old:
+                if j < n and j not in young and dl[j] is not _CONT:
+                    dl[j] = None
+            self._rec_old = young
+            self._rec_young = young = set()
+        young.add(i)
+        self._dlist[i] = rec
+
+    def _compile_record(self, i, lines):
+        """Lay out the record starting at line i from the cached state.
+
+        Returns None for the record still open in the layout pass.
+        While the pass is incomplete its block state is saved around
+        the compile so measure_step() resumes where it stopped.
+        """
+        if self._measure_done:
+            return self._compile(i, lines)
+        if i == self._rec_start:
+            return None
+        saved = (self.current_y, self._rec_y, self._rec_line, self._ops,
+                 self._in_code_fence, self._code_lang, self._in_math_fence,
+                 self._table_buffer, self._math_buffer,
+                 self._blockquote_depth)
+        self._table_buffer = []
+        self._math_buffer = []
+        try:
+            return self._compile(i, lines)
+        finally:
+            (self.current_y, self._rec_y, self._rec_line, self._ops,
+             self._in_code_fence, self._code_lang, self._in_math_fence,
+             self._table_buffer, self._math_buffer,
+             self._blockquote_depth) = saved
+
+    def _compile(self, i, lines):
+        self._set_fence_state(lines, i, self._line_fence_cache[i])
+        del self._table_buffer[:]
+        dl = self._dlist
+        n = len(dl)
+        self.current_y = self._line_y_cache[i]
+        self._rec_y = self.current_y
+        self._ops = []
+        skip_lines = self._skip_lines
+        j = i
+        while True:
+            self._rec_line = j
+            if skip_lines and j in skip_lines:
+                self._track_fence(lines[j])
+            else:
+                self._render_line(lines[j], j)
+            j += 1
+            if j >= n or dl[j] is not _CONT:
+                break
+        if self._table_buffer:
+            self._flush_table()
+        rec = tuple(self._ops)
+        self._ops = None
+        self._in_code_fence = False
+        self._keep_record(i, rec)
+        return rec
+
+    def _track_fence(self, line):
+        """Track fence state for a line hidden by a collapsed header."""
+        stripped = line.strip()
+        if stripped.startswith('```'):
+            if self._in_math_fence:
+                self._in_math_fence = False
+            elif self._in_code_fence:
+                self._in_code_fence = False
+            else:
+                tag = stripped[3:].strip().lower()
+                if tag in ('math', 'formula', 'cas'):
+                    self._in_math_fence = True
+                else:
+                    self._in_code_fence = True
+
+    def _emit(self, code, x, y, vh, *args):
+        """Append a draw op at absolute layout Y to the open record."""
+        self._ops.append((code, x, y - self._rec_y, vh) + args)
+
+    def _replay(self, lines, gr):
+        """Draw the display-list records that intersect the viewport.
+
+        With gr None only the link and header zones are collected.
+        """
+        cache = self._line_y_cache
+        dl = self._dlist
+        n = len(dl)
+        base = self.y - self.scroll_offset
+        bottom = self.scroll_offset + self.height
+        i = self._find_first_visible()
+        while i < n:
+            y0 = cache[i]
+            if y0 > bottom:
+                break
+            rec = dl[i]
+            if rec is None:
+                rec = self._compile_record(i, lines)
+            elif i not in self._rec_young:
+                self._keep_record(i, rec)
+            if rec:
+                self._draw_record(rec, base + y0, lines, gr,
+                                  self.y, self.y + self.height)
+            i += 1
+
+    def _strip_next(self, i):
+        """Return the line starting the record after the one at line i."""
+        dl = self._dlist
+        n = len(dl)
+        i += 1
+        while i < n and dl[i] is _CONT:
+            i += 1
+        return i
+
+    def _strip_end(self, i):
+        """Return the abs Y end of the record at line i, or -1 if unknown."""
+        j = self._strip_next(i)
+        if j < len(self._dlist):
+            return self._line_y_cache[j]
+        return self._content_height if self._measure_done else -1
+
+    def _strip_draw(self, c0, c1, i, j, lines):
+        """Clear the band of records [c0, c1), then draw records [i, j).
+
+        Callers include the neighbouring record below the band (or
+        above it) so glyphs overhanging a record edge are painted in
+        the same top-to-bottom order as a direct replay.
+        """
+        cache = self._line_y_cache
+        dl = self._dlist
+        top = self._strip_top
+        y1 = cache[c1] if c1 < len(dl) else self._content_height
+        bg = theme.colors['bg']
+        draw_rectangle(GR_STRIP, 0, cache[c0] - top, 320, y1 - top,
+                       bg, 255, bg, 255)
+        while i < j:
+            rec = dl[i]
+            if rec is None:
+                rec = self._compile_record(i, lines)
+            if rec:
+                self._draw_record(rec, cache[i] - top, lines, GR_STRIP,
+                                  0, STRIP_HEIGHT)
+            i = self._strip_next(i)
+
+    def _strip_rebase(self, new_top):
+        """Move the strip window, keeping records that still fit in it."""
+        old_top = self._strip_top
+        self._strip_top = new_top
+        i0 = self._strip_i0
+        if i0 < 0:
+            return
+        d = new_top - old_top
+        if d >= STRIP_HEIGHT or -d >= STRIP_HEIGHT:
+            self._strip_i0 = -1
+            return
+        flush()
+        if d > 0:
+            strblit2(GR_STRIP, 0, 0, 320, STRIP_HEIGHT - d,
+                     GR_STRIP, 0, d, 320, STRIP_HEIGHT - d)
+        elif d < 0:
+            strblit2(GR_STRIP, 0, -d, 320, STRIP_HEIGHT + d,
+                     GR_STRIP, 0, 0, 320, STRIP_HEIGHT + d)
+        cache = self._line_y_cache
+        i1 = self._strip_i1
+        while i0 < i1 and cache[i0] < new_top:
+            i0 = self._strip_next(i0)
+        bottom = new_top + STRIP_HEIGHT
+        n = len(self._dlist)
+        if i1 >= n and self._content_height <= bottom:
+            # Past the end of the document: re-clear the newly exposed rows
+            bg = theme.colors['bg']
+            y = self._content_height - new_top
+            if y < 0:
+                y = 0
+            draw_rectangle(GR_STRIP, 0, y, 320, STRIP_HEIGHT,
+                           bg, 255, bg, 255)
+        else:
+            while i1 > i0 and (cache[i1] if i1 < n
+                               else self._content_height) > bottom:
+                k = i1 - 1
+                while k > i0 and self._dlist[k] is _CONT:
+                    k -= 1
+                i1 = k
+        self._strip_i0 = i0
+        self._strip_i1 = i1
+
+    def _strip_paint(self, lines):
+        """Serve the viewport from the strip cache and blit it to gr.
+
+        The strip holds whole records for up to STRIP_HEIGHT pixels
+        around the viewport.  Scrolling only draws the records exposed
+        at either edge, and moves the strip window when the viewport
+        leaves it.  Returns False if the viewport cannot be covered
+        (unmeasured or oversized records), so render() falls back to a
+        direct replay.
+        """
+        s = self.scroll_offset
+        h = self.height
+        cache = self._line_y_cache
+        dl = self._dlist
+        n = len(dl)
+        if self._strip_dark != theme.is_dark():
+            # Theme switched without invalidate_paint()
+            self._strip_dark = theme.is_dark()
+            self._strip_i0 = -1
+        # The record at the top of the viewport must fit in the window
+        f = self._find_first_visible()
+        y0 = cache[f] if f < n else s
+        top = self._strip_top
+        if y0 < top or s + h > top + STRIP_HEIGHT:
+            top = s - (STRIP_HEIGHT - h) // 2
+            if top > y0:
+                top = y0
+            self._strip_rebase(top if top > 0 else 0)
+            top = self._strip_top
+        fresh = self._strip_i0 < 0
+        if fresh:
+            self._strip_i0 = f
+            self._strip_i1 = f
+
+        # Extend downwards to half a screen past the viewport
+        i1 = self._strip_i1
+        limit = s + h + h // 2
+        if limit > top + STRIP_HEIGHT:
+            limit = top + STRIP_HEIGHT
+        j = i1
+        while j < n and cache[j] < limit:
+            end = self._strip_end(j)
+            if end < 0 or end > top + STRIP_HEIGHT:
+                break
+            if j == self._rec_start:
+                break
+            j = self._strip_next(j)
+        if j >= n and self._measure_done and (i1 < n or fresh):
+            bg = theme.colors['bg']
+            draw_rectangle(GR_STRIP, 0, self._content_height - top,
+                           320, STRIP_HEIGHT, bg, 255, bg, 255)
+        if j > i1:
+            p = i1
+            if i1 > self._strip_i0:
+                p = i1 - 1
+                while p > 0 and dl[p] is _CONT:
+                    p -= 1
+            self._strip_draw(i1, j, p, j, lines)
+        self._strip_i1 = j
+
+        # Extend upwards to half a screen above the viewport
+        i0 = self._strip_i0
+        limit = s - h // 2
+        if limit < top:
+            limit = top
+        k = i0
+        while k > 0 and cache[k] > limit:
+            p = k - 1
+            while p > 0 and dl[p] is _CONT:
+                p -= 1
+            if cache[p] < top:
+                break
+            k = p
+        if k < i0:
+            e = i0
+            if i0 < self._strip_i1:
+                e = self._strip_next(i0)
+            self._strip_draw(k, i0, k, e, lines)
+        self._strip_i0 = k
+
+        lo = cache[k] if k < n else 0
+        hi = cache[j] if j < n else top + STRIP_HEIGHT
+        if lo > s or hi < s + h:
+            if top < y0:
+                # A record straddles the window bottom: move the window
+                # down to the viewport and try once more.
+                self._strip_rebase(y0)
+                return self._strip_paint(lines)
+            self._strip_i0 = -1
+            return False
+        flush()
+        strblit2(self.gr, self.x, self.y, self.width, h,
+                 GR_STRIP, self.x, s - top, self.width, h)
+        return True
+
+    def _draw_record(self, rec, oy, lines, gr, top, bot):
+        """Replay one display-list record with its first line at oy in gr.
+
+        Ops entirely outside top..bot are skipped; ops crossing an edge
+        are drawn whole and left to the caller's blit to clip, so a
+        direct replay shows the same partly visible lines as the strip.
+        Link and header zones are recorded when drawing to the viewport
+        buffer; with gr None only the zones are recorded.
+        """
+        zones = gr is None or gr == self.gr
+        c = theme.colors
+        hits = self._search_hits
+        for op in rec:
+            y = oy + op[2]
+            if y >= bot or y + op[3] <= top:
+                continue
+            code = op[0]
+            x = op[1]
+            if code == _OP_LINK or code == _OP_HDR:
+                if zones:
+                    if code == _OP_LINK:
+                        self._link_zones.append((x, y, op[4], y + op[5], op[6]))
+                    else:
+                        self._header_zones.append((x, y, op[4], y + op[5], op[6]))
+                continue
+            if gr is None:
+                continue
+            if code == _OP_TEXT or code == _OP_RUN:
+                text = op[4]
+                color = c[op[6]]
+                style = op[10]
+                if style & _ST_SEARCH and hits:
+                    sp = self._hit_ranges(op[12], lines)
+                    hl = c['search_hl']
+                    for k in range(0, len(sp), 2):
+                        p = self._op_span(op, sp[k], sp[k + 1])
+                        if p:
+                            x0 = self._text_x(op, p[0])
+                            x1 = self._text_x(op, p[1])
+                            draw_rectangle(gr, x + x0, y, x + x1,
+                                           y + op[9], hl, 255, hl, 255)
+                draw_text(gr, x, y, text, op[5], color, op[7])
+                if style & _ST_BOLD:
+                    draw_text(gr, x + 1, y, text, op[5], color, op[7])
+            elif code == _OP_RECT:
+                draw_rectangle(gr, x, y, x + op[4], y + op[5],
+                               c[op[6]], 255, c[op[7]], 255)
+            elif code == _OP_FORMULA:
+                render_formula(gr, x, y, op[4], op[5], op[6],
+                               c.get('formula_border', c['table_border']),
+                               c['normal'],
+                               c.get('formula_bg', 0xF0F0FF))
+            elif code == _OP_IMG_FILE:
+                try:
+                    open_file(GR_TMP, op[4])
+                    blit(gr, x, y, x + op[5], y + op[6],
+                         GR_TMP, 0, 0, op[7], op[8], TRANSPARENCY)
+                except:
+                    pass
+            elif code == _OP_IMG_B64:
+                img = self._decode_image_line(lines[op[4]])
+                if img:
+                    draw_image(gr, x, y, img[2], img[0], img[1])
+
+    def _hit_ranges(self, li, lines):
+        """Return the flat (start, end) source offsets of line li's hits."""
+        sp = self._hl_cache.get(li)
+        if sp is not None:
+            return sp
+        hits = self._search_hits
+        lo = 0
+        hi = len(hits) // 2
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if hits[2 * mid] < li:
+                lo = mid + 1
+            else:
+                hi = mid
+        sp = []
+        k = 2 * lo
+        rx = self._search_re
+        n = len(self._search_term or '')
+        text = None
+        while k < len(hits) and hits[k] == li:
+            off = hits[k + 1]
+            if rx:
+                # The stored offset is where the line scan matched;
+                # matching again from there gives the end
+                if text is None:
+                    text = lines[li]
+                    if not self._search_case:
+                        text = text.lower()
+                m = rx.match(text[off:])
+                end = off + len(m.group(0)) if m else off
+            else:
+                end = off + n
+            if end > off:
+                sp.append(off)
+                sp.append(end)
+            k += 2
+        if len(self._hl_cache) >= 64:
+            self._hl_cache = {}
+        self._hl_cache[li] = sp
+        return sp
+
+    def _op_span(self, op, a, b):
+        """Map source offsets a..b to (p0, p1) in op's string, or None."""
+        if op[0] == _OP_TEXT:
+            src = op[11]
+            p0 = a - src if a > src else 0
+            p1 = b - src
+            n = len(op[4])
+            if p1 > n:
+                p1 = n
+            return (p0, p1) if p0 < p1 else None
+        # Runs: from the first to the last word the range overlaps, so
+        # the spaces between them are covered as well
+        sp = op[11]
+        p0 = -1
+        p1 = -1
+        for k in range(0, len(sp), 5):
+            src = sp[k + 4]
+            if src < 0:
+                continue
+            n = sp[k + 1] - sp[k]
+            if src < b and src + n > a:
+                if p0 < 0:
+                    p0 = sp[k] + (a - src if a > src else 0)
+                p1 = sp[k] + (b - src if b - src < n else n)
+        return (p0, p1) if p0 >= 0 else None
+
+    def _text_x(self, op, pos):
+        """X offset of character pos within a text or run op's string."""
+        text = op[4]
+        if op[0] == _OP_TEXT:
+            return text_width(text[:pos], op[5]) if pos else 0
+        # Runs: measure from the start of the word containing pos
+        sp = op[11]
+        k = len(sp) - 5
+        while k > 0 and sp[k] > pos:
+            k -= 5
+        start = sp[k]
+        if pos <= start:
+            return sp[k + 2]
+        return sp[k + 2] + text_width(text[start:pos], op[5])
+
+    def _section_tree(self, lines):
+        """Return {header line: (section end line, level)}.
+
+        A section runs up to the next header of the same or a higher
+        level.  Headers inside code and math fences are ignored.  Built
+        once per document.
+        """
+        if self._sections is not None and self._sections_src is lines:
+            return self._sections
+        secs = {}
+        stack = []      # open sections as (line, level)
+        fence = False
+        i = 0
+        for line in lines:
+            if line.strip().startswith('```'):
+                fence = not fence
+            elif not fence and line.startswith('#'):
+                lvl = 1
+                while lvl < 6 and lvl < len(line) and line[lvl] == '#':
+                    lvl += 1
+                while stack and stack[-1][1] >= lvl:
+                    h, hl = stack.pop()
+                    secs[h] = (i, hl)
+                stack.append((i, lvl))
+            i += 1
+        for h, hl in stack:
+            secs[h] = (i, hl)
+        self._sections = secs
+        self._sections_src = lines
+        return secs
 
     def _compute_skip_lines(self, lines):
         """Compute set of line indices hidden by collapsed headers."""
         if not self._collapsed_headers:
             return None
+        secs = self._section_tree(lines)
         skip = set()
-        n = len(lines)
         for ci in self._collapsed_headers:
-            if ci >= n:
-                continue
-            hline = lines[ci].strip()
-            lvl = 0
-            while lvl < len(hline) and hline[lvl] == '#':
-                lvl += 1
-            for i in range(ci + 1, n):
-                sl = lines[i].strip()
-                if sl.startswith('#'):
-                    hlvl = 0
-                    while hlvl < len(sl) and sl[hlvl] == '#':
-                        hlvl += 1
-                    if hlvl <= lvl:
-                        break
-                skip.add(i)
+            sec = secs.get(ci)
+            if sec:
+                skip.update(range(ci + 1, sec[0]))
         return skip if skip else None
 
     def _render_line(self, line, line_idx=-1):
         """Render a single line of markdown."""
         line = line.rstrip()
+        self._src_line = line
 
         # Handle code/math fences
         if line.strip().startswith('```'):
@@ -711,13 +1765,13 @@ class MarkdownRenderer:
     def _tokenize_code(self, line, lang):
         """Tokenize a code line into (text, color_key) segments."""
         c = theme.colors
-        code_c = c['code']
-        kw_c = c.get('syn_keyword', code_c)
-        str_c = c.get('syn_string', code_c)
-        cmt_c = c.get('syn_comment', code_c)
-        num_c = c.get('syn_number', code_c)
-        bi_c = c.get('syn_builtin', code_c)
-        dec_c = c.get('syn_decorator', code_c)
+        code_c = 'code'
+        kw_c = 'syn_keyword' if 'syn_keyword' in c else code_c
+        str_c = 'syn_string' if 'syn_string' in c else code_c
+        cmt_c = 'syn_comment' if 'syn_comment' in c else code_c
+        num_c = 'syn_number' if 'syn_number' in c else code_c
+        bi_c = 'syn_builtin' if 'syn_builtin' in c else code_c
+        dec_c = 'syn_decorator' if 'syn_decorator' in c else code_c
         kw_set = self._KW.get(lang)
         bi_set = self._BUILTINS.get(lang)
         tokens = []
@@ -790,34 +1844,34 @@ class MarkdownRenderer:
         return tokens
 
     def _render_code_line(self, line):
-        """Render a line inside a code fence with syntax highlighting."""
-        if self._in_view(self.current_y, self.line_height):
-            code_bg = theme.colors['code_bg']
-            # Fill background in one call, then overlay text without bg_color
-            from hpprime import fillrect as _fr
-            _fr(self.gr, self.x, self.current_y,
-                self.width, self.line_height, code_bg, code_bg)
-            if line:
-                lang = self._code_lang
-                if lang and lang in self._KW:
-                    tokens = self._tokenize_code(line, lang)
-                    cx = self.x + 4
-                    max_x = self.x + self.width
-                    bf = self._body_font
-                    for text, color in tokens:
-                        tw = text_width(text, bf)
-                        if cx + tw > max_x:
-                            break
-                        draw_text(self.gr, cx, self.current_y + 1,
-                                  text, bf, color,
-                                  max_x - cx)
-                        cx += tw
-                else:
-                    draw_text(self.gr, self.x + 4, self.current_y + 1,
-                              line, self._body_font,
-                              theme.colors['code'],
-                              self.width - 4)
-        self.current_y += self.line_height
+        """Lay out a line inside a code fence with syntax highlighting."""
+        y = self.current_y
+        lh = self.line_height
+        # Fill background in one op, then overlay text without bg_color
+        self._emit(_OP_RECT, self.x, y, lh,
+                   self.width, lh, 'code_bg', 'code_bg')
+        if line:
+            bf = self._body_font
+            lang = self._code_lang
+            if lang and lang in self._KW:
+                tokens = self._tokenize_code(line, lang)
+                cx = self.x + 4
+                max_x = self.x + self.width
+                src = 0     # tokens are consecutive slices of the line
+                for text, color in tokens:
+                    tw = text_width(text, bf)
+                    if cx + tw > max_x:
+                        break
+                    self._emit(_OP_TEXT, cx, y + 1, lh - 1,
+                               text, bf, color, max_x - cx, tw, lh,
+                               _ST_SEARCH, src, self._rec_line)
+                    cx += tw
+                    src += len(text)
+            else:
+                self._emit(_OP_TEXT, self.x + 4, y + 1, lh - 1,
+                           line, bf, 'code', self.width - 4, 0, lh,
+                           _ST_SEARCH, 0, self._rec_line)
+        self.current_y += lh
 
     def _flush_math(self):
         """Render collected math fence lines as pretty-printed formulas."""
@@ -828,7 +1882,7 @@ class MarkdownRenderer:
         del self._math_buffer[:]
 
     def _render_formula(self, expr):
-        """Render a CAS expression as a formatted formula."""
+        """Lay out a CAS expression as a formatted formula."""
         # Get cached dimensions or measure
         if expr in self._formula_cache:
             size = self._formula_cache[expr]
@@ -852,14 +1906,7 @@ class MarkdownRenderer:
         # Center horizontally
         fx = self.x + (self.width - total_w) // 2
 
-        c = theme.colors
-        if self._in_view(self.current_y, total_h):
-            render_formula(self.gr, fx, self.current_y,
-                           expr, fw, fh,
-                           c.get('formula_border', c['table_border']),
-                           c['normal'],
-                           c.get('formula_bg', 0xF0F0FF))
-
+        self._emit(_OP_FORMULA, fx, self.current_y, total_h, expr, fw, fh)
         self.current_y += total_h + 4
 
     def _is_ordered_list(self, line):
@@ -870,18 +1917,14 @@ class MarkdownRenderer:
         return False
 
     def _render_hr(self):
-        """Render a horizontal rule."""
+        """Lay out a horizontal rule."""
         self.current_y += 4
-        if self._in_view(self.current_y, 1):
-            c = theme.colors
-            draw_rectangle(self.gr, self.x, self.current_y,
-                      self.x + self.width, self.current_y + 1,
-                      c['normal'], 255,
-                      c['normal'], 255)
+        self._emit(_OP_RECT, self.x, self.current_y, 1,
+                   self.width, 1, 'normal', 'normal')
         self.current_y += 6
 
     def _render_header(self, line, line_idx=-1):
-        """Render a header line (# Header)."""
+        """Lay out a header line (# Header)."""
         level = 0
         while level < len(line) and line[level] == '#':
             level += 1
@@ -906,21 +1949,20 @@ class MarkdownRenderer:
         display = prefix + text
 
         h = self.line_height + fontsize * 4
-        if self._in_view(self.current_y, h):
-            draw_text(self.gr, self.x, self.current_y,
-                      display, fontsize, theme.colors['header'],
-                      self.width)
-            # Record tappable header zone
-            if line_idx >= 0:
-                self._header_zones.append((
-                    self.x, self.current_y,
-                    self.x + self.width,
-                    self.current_y + h, line_idx))
+        y = self.current_y
+        self._emit(_OP_TEXT, self.x, y, h,
+                   display, fontsize, 'header', self.width, 0, h,
+                   _ST_SEARCH, line.find(text, level) - len(prefix),
+                   self._rec_line)
+        # Record tappable header zone
+        if line_idx >= 0:
+            self._emit(_OP_HDR, self.x, y, h,
+                       self.x + self.width, h, line_idx)
         self.current_y += h
         self.current_y += 3
 
     def _render_blockquote(self, line):
-        """Render a blockquote line (> text), supports nesting."""
+        """Lay out a blockquote line (> text), supports nesting."""
         depth = 0
         temp = line
         while temp.startswith('>'):
@@ -935,40 +1977,32 @@ class MarkdownRenderer:
         self._blockquote_depth = 0
 
     def _render_task_list_item(self, text, checked, indent_level=0):
-        """Render a task list item with checkbox."""
+        """Lay out a task list item with checkbox."""
         indent = indent_level * NESTED_LIST_INDENT
         box_x = self.x + 10 + indent
         box_y = self.current_y + 2
         box_size = 8
         text_x = box_x + box_size + 5
 
-        if self._in_view(self.current_y):
-            c = theme.colors
-            # Draw checkbox border
-            draw_rectangle(self.gr, box_x, box_y,
-                           box_x + box_size, box_y + box_size,
-                           c['normal'], 255,
-                           c['bg'], 255)
-            if checked:
-                # Draw filled check indicator
-                draw_rectangle(self.gr, box_x + 2, box_y + 2,
-                               box_x + box_size - 2, box_y + box_size - 2,
-                               c['task_done'], 255,
-                               c['task_done'], 255)
+        # Checkbox border
+        self._emit(_OP_RECT, box_x, box_y, 10,
+                   box_size, box_size, 'normal', 'bg')
+        if checked:
+            # Filled check indicator
+            self._emit(_OP_RECT, box_x + 2, box_y + 2, 8,
+                       box_size - 4, box_size - 4, 'task_done', 'task_done')
 
         self._render_wrapped(text, text_x)
 
     def _render_list_item(self, text, bullet='\u2022', indent_level=0):
-        """Render a list item with bullet or number prefix."""
+        """Lay out a list item with bullet or number prefix."""
         indent = indent_level * NESTED_LIST_INDENT
         bullet_x = self.x + 10 + indent
         text_x = self.x + 25 + indent
 
-        if self._in_view(self.current_y):
-            draw_text(self.gr, bullet_x, self.current_y,
-                      bullet, self._body_font,
-                      theme.colors['normal'],
-                      self.x + self.width - bullet_x)
+        self._emit(_OP_TEXT, bullet_x, self.current_y, 12,
+                   bullet, self._body_font, 'normal',
+                   self.x + self.width - bullet_x, 0, 12, 0)
         self._render_wrapped(text, text_x)
 
     def _is_table_separator(self, cells):
@@ -982,30 +2016,37 @@ class MarkdownRenderer:
     def _buffer_table_line(self, line):
         """Buffer a table row for later rendering."""
         parts = line.split('|')
+        offs = []
+        k = 0
+        for c in parts:
+            offs.append(k + len(c) - len(c.lstrip()))
+            k += len(c) + 1
         if parts and parts[0].strip() == '':
             parts = parts[1:]
+            offs = offs[1:]
         if parts and parts[-1].strip() == '':
             parts = parts[:-1]
         cells = [c.strip() for c in parts]
         if self._is_table_separator(cells):
             return
-        self._table_buffer.append(cells)
+        # Cells with their line offsets, for search highlighting
+        self._table_buffer.append((cells, offs, self._rec_line))
 
     def _flush_table(self):
-        """Render a buffered table."""
+        """Lay out a buffered table."""
         rows = self._table_buffer
         self._table_buffer = []
         if not rows:
             return
 
-        num_cols = max(len(r) for r in rows)
+        num_cols = max(len(r[0]) for r in rows)
 
         if num_cols > TABLE_MAX_COLS:
             self._render_table_warning(num_cols)
             return
 
         col_widths = [0] * num_cols
-        for row in rows:
+        for row, _, _ in rows:
             for i in range(len(row)):
                 if i < num_cols:
                     w = text_width(row[i], self._body_font)
@@ -1025,51 +2066,43 @@ class MarkdownRenderer:
             total_w = self.width
 
         row_h = self.line_height + 2
-        c = theme.colors
-        th_bg = c['table_header_bg']
-        alt_bg = c['table_alt_bg']
-        bg = c['bg']
-        t_border = c['table_border']
-        c_bold = c['bold']
-        c_normal = c['normal']
 
         for ri in range(len(rows)):
-            row = rows[ri]
+            row, offs, li = rows[ri]
             is_header = (ri == 0)
 
             if is_header:
-                row_bg = th_bg
-            elif ri % 2 == 0:
-                row_bg = alt_bg
+                row_bg = 'table_header_bg'
+                txt_color = 'bold'
+                style = _ST_BOLD  # faux-bold header
             else:
-                row_bg = bg
+                row_bg = 'table_alt_bg' if ri % 2 == 0 else 'bg'
+                txt_color = 'normal'
+                style = 0
 
-            # Draw cell rectangles 1px larger so adjacent borders overlap
+            # Cell rectangles are 1px larger so adjacent borders overlap
             # (avoids double-thick internal grid lines).
-            if self._in_view(self.current_y, row_h + 1):
-                cx = self.x
-                gr = self.gr
-                for ci in range(num_cols):
-                    cell_w = col_widths[ci] + pad * 2
-                    cell_text = row[ci] if ci < len(row) else ''
-
-                    # +1 on right/bottom so internal borders overlap instead of doubling
-                    draw_rectangle(gr, cx, self.current_y,
-                                  cx + cell_w + 1, self.current_y + row_h + 1,
-                                  t_border, 255, row_bg, 255)
-
-                    txt_color = c_bold if is_header else c_normal
-                    # No bg_color here: TEXTOUT_P background can overwrite borders.
-                    # Shift down by 1px compared to the old code.
-                    draw_text(gr, cx + pad, self.current_y + 3,
-                              cell_text, FONT_10, txt_color,
-                              col_widths[ci])
-                    # Faux-bold header
-                    if is_header:
-                        draw_text(gr, cx + pad + 1, self.current_y + 3,
-                                  cell_text, FONT_10, c_bold,
-                                  col_widths[ci])
-                    cx += cell_w
+            y = self.current_y
+            cx = self.x
+            for ci in range(num_cols):
+                cell_w = col_widths[ci] + pad * 2
+                cell_text = row[ci] if ci < len(row) else ''
+
+                # +1 on right/bottom so internal borders overlap instead of doubling
+                self._emit(_OP_RECT, cx, y, row_h + 1,
+                           cell_w + 1, row_h + 1, 'table_border', row_bg)
+                # No bg_color here: TEXTOUT_P background can overwrite borders.
+                # Shift down by 1px compared to the old code.
+                if ci < len(row):
+                    self._emit(_OP_TEXT, cx + pad, y + 3, row_h - 2,
+                               cell_text, FONT_10, txt_color,
+                               col_widths[ci], 0, row_h,
+                               style | _ST_SEARCH, offs[ci], li)
+                else:
+                    self._emit(_OP_TEXT, cx + pad, y + 3, row_h - 2,
+                               cell_text, FONT_10, txt_color,
+                               col_widths[ci], 0, row_h, style)
+                cx += cell_w
 
             self.current_y += row_h
 
@@ -1078,10 +2111,9 @@ class MarkdownRenderer:
     def _render_table_warning(self, num_cols):
         """Show a warning when a table is too wide to render."""
         msg = '[Table too wide (' + str(num_cols) + ' cols)]'
-        if self._in_view(self.current_y):
-            draw_text(self.gr, self.x, self.current_y,
-                      msg, self._body_font, theme.colors['warning'],
-                      self.width)
+        self._emit(_OP_TEXT, self.x, self.current_y, 12,
+                   msg, self._body_font, 'warning', self.width,
+                   0, self.line_height, 0)
         self.current_y += self.line_height
 
     def _render_paragraph(self, line):
@@ -1089,124 +2121,194 @@ class MarkdownRenderer:
         self._render_wrapped(line, self.x)
 
     def _draw_line_decorations(self):
-        """Draw blockquote decorations for the current line."""
-        if self._blockquote_depth > 0 and self._in_view(self.current_y, self.line_height):
-            bq_bg = theme.colors['blockquote_bg']
-            bq_bar = theme.colors['blockquote_bar']
-            draw_rectangle(self.gr, self.x, self.current_y,
-                           self.x + self.width, self.current_y + self.line_height,
-                           bq_bg, 255, bq_bg, 255)
+        """Lay out blockquote decorations for the current line."""
+        if self._blockquote_depth > 0:
+            y = self.current_y
+            lh = self.line_height
+            self._emit(_OP_RECT, self.x, y, lh,
+                       self.width, lh, 'blockquote_bg', 'blockquote_bg')
             for d in range(self._blockquote_depth):
                 bx = self.x + d * BLOCKQUOTE_INDENT + 3
-                draw_rectangle(self.gr, bx, self.current_y,
-                               bx + BLOCKQUOTE_BAR_WIDTH,
-                               self.current_y + self.line_height,
-                               bq_bar, 255, bq_bar, 255)
+                self._emit(_OP_RECT, bx, y, lh,
+                           BLOCKQUOTE_BAR_WIDTH, lh,
+                           'blockquote_bar', 'blockquote_bar')
 
     def _render_wrapped(self, text, start_x):
-        """Render text with word wrapping and inline formatting."""
+        """Lay out text with word wrapping and inline formatting.
+
+        Word positions and visual-line breaks come from _wrap_cache, so
+        laying out a line again with the same start_x, body font,
+        word-wrap flag and width needs no text_width calls.  The cache
+        keeps two generations of WRAP_CACHE_LINES lines, like the text
+        width cache, so it covers the records being recompiled around
+        the viewport rather than the whole document.
+        """
         segments = self._parse_inline(text)
-        current_x = start_x
         max_x = self.x + self.width - SCROLLBAR_WIDTH - 1
+        key = (start_x, self._body_font, self._word_wrap, self.width)
+        li = self._rec_line
+        entry = None
+        if li >= 0:
+            entry = self._wrap_cache.get(li)
+            if entry is None:
+                entry = self._wrap_old.get(li)
+        stale = entry is None or entry[0] != key
+        if stale:
+            entry = self._wrap_breaks(segments, key, max_x)
+        if li >= 0 and (stale or li not in self._wrap_cache):
+            if len(self._wrap_cache) >= WRAP_CACHE_LINES:
+                self._wrap_old = self._wrap_cache
+                self._wrap_cache = {}
+            self._wrap_cache[li] = entry
+        sp_w = entry[1]
+        nlines = entry[2]
+        pos = entry[3]
 
         self._draw_line_decorations()
 
-        # Cache frequently accessed theme colors
-        c = theme.colors
-        color_map = {
-            'normal': c['normal'],
-            'bold': c['bold'],
-            'italic': c['italic'],
-            'code': c['code'],
-            'link': c['link'],
-            'strikethrough': c['strikethrough'],
-        }
-        search_hl = c['search_hl']
-        search_term = self._search_term
-        # Cache body font, space width and line height
-        bf = self._body_font
-        wrap = self._word_wrap
-        sp_w = text_width(' ', bf)
         lh = self.line_height
-        gr = self.gr
-        in_view = self._in_view
-
+        emit = self._emit
+        line = 0
+        k = 0
+
+        # Source offsets: text is a suffix of the source line and each
+        # segment's text is found in it in order; -1 where unknown.
+        base = self._src_line.rfind(text) if li >= 0 and text else -1
+        cur = 0
+
+        # Words are merged into runs: consecutive words of the same
+        # segment type on one visual line are drawn as a single string.
+        run = []        # [text, x, y, type, style, clip_w, spans, width]
         for seg in segments:
             seg_type = seg[0]
-            seg_text = seg[1]
             seg_url = seg[2] if len(seg) > 2 else None
-            color = color_map.get(seg_type, color_map['normal'])
+            style = _ST_SEARCH if base >= 0 else 0
+            if seg_type == 'bold':
+                style |= _ST_BOLD
+            src = text.find(seg[1], cur) if base >= 0 else -1
+            if src >= 0:
+                cur = src + len(seg[1])
+                src += base
+
+            for word in seg[1].split(' '):
+                ws = src
+                if src >= 0:
+                    src += len(word) + 1
+                if not word:
+                    continue
+                current_x = pos[k]
+                wl = pos[k + 1]
+                w = pos[k + 2]
+                k += 3
+                while line < wl:
+                    self._emit_run(run, lh)
+                    self.current_y += lh
+                    line += 1
+                    self._draw_line_decorations()
+
+                y = self.current_y
+                clip_w = max_x - current_x
+                if clip_w <= 0:
+                    continue
+
+                # Extend the open run when the word directly follows it
+                # (same line, type and style, separated by one space or
+                # none), otherwise start a new one.
+                if run and run[2] == y and run[3] == seg_type:
+                    gap = current_x - run[1] - run[7]
+                    if gap == 0 or gap == sp_w:
+                        text_r = run[0]
+                        if gap:
+                            text_r += ' '
+                        run[6].append((len(text_r), len(text_r) + len(word),
+                                       current_x - run[1], w, ws))
+                        run[0] = text_r + word
+                        run[7] = current_x - run[1] + w
+                    else:
+                        self._emit_run(run, lh)
+                elif run:
+                    self._emit_run(run, lh)
+                if not run:
+                    run.extend((word, current_x, y, seg_type, style,
+                                clip_w, [(0, len(word), 0, w, ws)], w))
+
+                # Record link zones for tap detection
+                if seg_type == 'link' and seg_url:
+                    emit(_OP_LINK, current_x, y, 12,
+                         current_x + w, lh, seg_url)
+
+        self._emit_run(run, lh)
+        while line < nlines - 1:
+            self.current_y += lh
+            line += 1
+            self._draw_line_decorations()
+        self.current_y += lh
+
+    def _wrap_breaks(self, segments, key, max_x):
+        """Compute word positions and visual-line breaks for a line.
 
-            words = seg_text.split(' ')
+        Returns (key, space_width, line_count, positions) where positions
+        is an array of (x, visual_line, width) per non-empty word.
+        """
+        start_x = key[0]
+        bf = key[1]
+        wrap = key[2]
+        sp_w = text_width(' ', bf)
+        current_x = start_x
+        line = 0
+        pos = array('h')
+        for seg in segments:
+            words = seg[1].split(' ')
             for wi in range(len(words)):
                 word = words[wi]
                 if wi > 0:
                     if current_x + sp_w > max_x and current_x > start_x:
                         if wrap:
-                            self.current_y += lh
+                            line += 1
                             current_x = start_x
-                            self._draw_line_decorations()
                     else:
                         current_x += sp_w
 
                 if not word:
                     continue
 
-                word = str(word)
-                w = text_width(word, bf)
+                w = text_width(str(word), bf)
                 if current_x + w > max_x and current_x > start_x:
                     if wrap:
-                        self.current_y += lh
+                        line += 1
                         current_x = start_x
-                        self._draw_line_decorations()
-
-                if in_view(self.current_y):
-                    clip_w = max_x - current_x
-                    if clip_w <= 0:
-                        current_x += w
-                        continue
-
-                    # Search highlighting
-                    hw = word if self._search_case else word.lower()
-                    if search_term and search_term in hw:
-                        draw_rectangle(gr, current_x, self.current_y,
-                                       current_x + w,
-                                       self.current_y + lh,
-                                       search_hl, 255, search_hl, 255)
-                        abs_y = self.current_y + self.scroll_offset
-                        if abs_y not in self._search_positions:
-                            self._search_positions.append(abs_y)
-
-                    draw_text(gr, current_x, self.current_y,
-                              word, bf, color, clip_w)
-                    if seg_type == 'bold':
-                        draw_text(gr, current_x + 1, self.current_y,
-                                  word, bf, color, clip_w)
-
-                    # Strikethrough line
-                    if seg_type == 'strikethrough':
-                        mid_y = self.current_y + lh // 2
-                        draw_rectangle(gr, current_x, mid_y,
-                                       current_x + w, mid_y + 1,
-                                       color, 255, color, 255)
-
-                    # Record link zones for tap detection
-                    if seg_type == 'link' and seg_url:
-                        self._link_zones.append((
-                            current_x, self.current_y,
-                            current_x + w,
-                            self.current_y + lh,
-                            seg_url))
-
-                elif search_term and search_term in word.lower():
-                    # Record position even for off-screen matches
-                    abs_y = self.current_y + self.scroll_offset
-                    if abs_y not in self._search_positions:
-                        self._search_positions.append(abs_y)
-
+                pos.append(current_x if current_x < 32767 else 32767)
+                pos.append(line)
+                pos.append(w if w < 32767 else 32767)
                 current_x += w
+        return (key, sp_w, line + 1, pos)
 
-        self.current_y += lh
+    def _emit_run(self, run, lh):
+        """Emit the open word run as one text op and reset it."""
+        if not run:
+            return
+        text, x, y, seg_type, style, clip_w, spans, w = run
+        if len(spans) == 1:
+            src = spans[0][4]
+            if style & _ST_SEARCH and src >= 0:
+                self._emit(_OP_TEXT, x, y, 12, text, self._body_font,
+                           seg_type, clip_w, w, lh, style, src,
+                           self._rec_line)
+            else:
+                self._emit(_OP_TEXT, x, y, 12, text, self._body_font,
+                           seg_type, clip_w, w, lh, style & ~_ST_SEARCH)
+        else:
+            flat = []
+            for sp in spans:
+                flat.extend(sp)
+            self._emit(_OP_RUN, x, y, 12, text, self._body_font, seg_type,
+                       clip_w, w, lh, style, tuple(flat), self._rec_line)
+        # Strikethrough line, per word
+        if seg_type == 'strikethrough':
+            for sp in spans:
+                self._emit(_OP_RECT, x + sp[2], y + lh // 2, 12 - lh // 2,
+                           sp[3], 1, seg_type, seg_type)
+        del run[:]
 
     def _parse_inline(self, text):
         """Parse inline markdown formatting.
@@ -1295,27 +2397,31 @@ class MarkdownRenderer:
 
         return segments if segments else [('normal', text)]
 
-    def _render_image(self, line):
-        """Render an image from ![alt](source)."""
+    def _image_url(self, line):
+        """Return the source of an ![alt](source) line, or None."""
         bracket_end = line.find(']')
         if bracket_end == -1:
-            self._render_paragraph(line)
-            return
+            return None
         paren_start = line.find('(', bracket_end)
         paren_end = line.rfind(')')
         if paren_start == -1 or paren_end == -1:
+            return None
+        return line[paren_start + 1:paren_end]
+
+    def _render_image(self, line):
+        """Lay out an image from ![alt](source)."""
+        url = self._image_url(line)
+        if url is None:
             self._render_paragraph(line)
             return
 
-        url = line[paren_start + 1:paren_end]
-
         if 'base64,' in url:
             self._render_base64_image(url)
         else:
             self._render_file_image(url)
 
     def _render_file_image(self, filename):
-        """Render an image loaded from a file via AFiles."""
+        """Lay out an image loaded from a file via AFiles."""
         try:
             open_file(GR_TMP, filename)
             size = get_grob_size(GR_TMP)
@@ -1330,36 +2436,50 @@ class MarkdownRenderer:
                 display_w = self.width
 
             img_x = self.x + (self.width - display_w) // 2
-            if self._in_view(self.current_y, display_h):
-                blit(self.gr, img_x, self.current_y,
-                     img_x + display_w, self.current_y + display_h,
-                     GR_TMP, 0, 0, img_w, img_h,
-                     TRANSPARENCY)
+            self._emit(_OP_IMG_FILE, img_x, self.current_y, display_h,
+                       filename, display_w, display_h, img_w, img_h)
             self.current_y += display_h + 4
         except:
             pass
 
     def _render_base64_image(self, url):
-        """Render an image from base64-encoded raw pixel data."""
+        """Lay out an image from base64-encoded raw pixel data.
+
+        Only the source line index is recorded; the pixels are decoded
+        again on replay instead of being kept in the display list.
+        """
+        img = self._decode_image(url)
+        if not img:
+            return
+        img_w, img_h, _ = img
+        img_x = self.x + (self.width - img_w) // 2
+        self._emit(_OP_IMG_B64, img_x, self.current_y, img_h,
+                   self._rec_line)
+        self.current_y += img_h + 4
+
+    def _decode_image_line(self, line):
+        """Decode the base64 image of a source line to (w, h, pixels)."""
+        url = self._image_url(line.strip())
+        if url is None or 'base64,' not in url:
+            return None
+        return self._decode_image(url)
+
+    def _decode_image(self, url):
+        """Decode a base64 raw image URL to (w, h, pixels), or None."""
         b64_data = url[url.index('base64,') + 7:]
         raw = self._base64_decode(b64_data)
         if len(raw) < 5:
-            return
+            return None
 
         img_w = (raw[0] << 8) | raw[1]
         img_h = (raw[2] << 8) | raw[3]
         pixel_data = raw[4:]
 
         if img_w <= 0 or img_h <= 0:
-            return
+            return None
         if len(pixel_data) < img_w * img_h * 3:
-            return
-
-        img_x = self.x + (self.width - img_w) // 2
-        if self._in_view(self.current_y, img_h):
-            draw_image(self.gr, img_x, self.current_y,
-                       pixel_data, img_w, img_h)
-        self.current_y += img_h + 4
+            return None
+        return (img_w, img_h, pixel_data)
 
     def _base64_decode(self, data):
         """Decode base64 string to bytes."""
@@ -1438,6 +2558,17 @@ class MarkdownRenderer:
         max_off = self._content_height - self.height
         return max_off if max_off > 0 else 0
 
+    def _clamp_scroll(self):
+        """Pull scroll_offset back into range once the height is exact.
+
+        While the layout is partial the content height is only an
+        estimate, so an offset taken from it (scroll_to_ratio, the
+        scrollbar) can end up past the real bottom.
+        """
+        m = self._max_scroll()
+        if self._measure_done and self.scroll_offset > m:
+            self.scroll_offset = m
+
     def scroll_up(self, amount=20):
         self.scroll_offset -= amount
         if self.scroll_offset < 0:
@@ -1479,46 +2610,158 @@ class MarkdownDocument:
     """Loads and manages markdown document content."""
 
     def __init__(self):
-        self.content = ""
         self.lines = []
+        self.search_index = SearchIndex(self.lines)
         self.renderer = None
         self._back_inited = False
-
-    def load_file(self, filename):
-        """Load markdown from a text file line-by-line to reduce peak memory."""
+        self._strip_inited = False
+        self.filename = None
+        self._doc_key = None      # 'size:digest' of the loaded content
+        self._sidecar = None      # saved layout awaiting the renderer
+        self._saved_key = None    # key of the sidecar on disk
+        self._outline = None      # cached get_outline() result
+
+    def load_file(self, filename, indexed=None):
+        """Load markdown from a text file into compact line storage.
+
+        Lines are packed into one buffer (PackedLines).  With
+        indexed=True they stay on disk behind an IndexedLines offset
+        index instead; None picks it for files of INDEXED_LOAD_BYTES or
+        more, or when the packed load runs out of memory.
+
+        Also reads the layout sidecar when it matches the content, so
+        the first render can skip the measurement pass.
+        """
         try:
-            lines = []
-            with open(filename, 'r') as f:
-                for line in f:
-                    lines.append(line.rstrip('\r\n'))
+            if indexed is None:
+                indexed = get_file_size(filename) >= INDEXED_LOAD_BYTES
+            lines = None
+            if not indexed:
+                try:
+                    lines = PackedLines(filename)
+                except MemoryError:
+                    gc.collect()
+            if lines is None:
+                lines = IndexedLines(filename)
+            key = layout_cache.digest(lines.raw_lines())
+            self.close()
             self.lines = lines
-            self.content = '\n'.join(lines)
+            self.search_index = SearchIndex(lines)
+            self._outline = None
+            self.filename = filename
+            self._doc_key = '%d:%s' % (lines.size, key)
+            self._sidecar = layout_cache.load(filename, self._doc_key)
+            if self._sidecar:
+                self._saved_key = self._sidecar[0]
             gc.collect()
             return True
         except:
-            self.content = "# Error\n\nCould not load file: " + filename
-            self.lines = self.content.split('\n')
+            self.lines = ("# Error\n\nCould not load file: "
+                          + filename).split('\n')
+            self.search_index = SearchIndex(self.lines)
+            self._outline = None
             return False
 
+    def get_outline(self):
+        """Return the header outline as (level, title, line_index) tuples.
+
+        Scans the lines once and caches the result; lines inside code
+        fences are skipped.  Like the renderer and the section tree, only
+        a '#' in the first column starts a header.
+        """
+        if self._outline is not None:
+            return self._outline
+        headers = []
+        fence = False
+        i = 0
+        for line in self.lines:
+            if line.strip().startswith('```'):
+                fence = not fence
+            elif not fence and line.startswith('#'):
+                level = 0
+                while level < len(line) and line[level] == '#':
+                    level += 1
+                if level > 6:
+                    level = 6
+                title = line[level:].strip()
+                if title:
+                    headers.append((level, title, i))
+            i += 1
+        self._outline = headers
+        return headers
+
+    def close(self):
+        """Release the backing file of an indexed document."""
+        if isinstance(self.lines, IndexedLines):
+            self.lines.close()
+
     def _ensure_back_buffer(self, width, height):
-        """Create/resize the off-screen back buffer once."""
+        """Create/resize the off-screen back buffer and scroll strip once."""
         if not self._back_inited:
-            from hpprime import dimgrob
             dimgrob(GR_BACK, width, height, 0)
+            try:
+                dimgrob(GR_STRIP, width, STRIP_HEIGHT, 0)
+                self._strip_inited = True
+            except:
+                self._strip_inited = False
             self._back_inited = True
 
     def _flip(self, x, y, width, height):
         """Blit the back buffer to the visible screen in one call."""
-        from hpprime import strblit2
         strblit2(GR_AFF, x, y, width, height,
                  GR_BACK, x, y, width, height)
 
+    def refresh_scrollbar(self):
+        """Redraw only the scrollbar column and flip it to screen."""
+        r = self.renderer
+        if r and r._content_height > r.height:
+            r._draw_scrollbar()
+            bx = r.x + r.width - SCROLLBAR_WIDTH
+            self._flip(bx, r.y, SCROLLBAR_WIDTH, r.height)
+
+    def _layout_key(self):
+        r = self.renderer
+        return layout_cache.make_key(self._doc_key, r._body_font,
+                                     r._word_wrap, r.width)
+
+    def _apply_sidecar(self):
+        """Adopt the loaded sidecar if it matches the renderer settings."""
+        sc = self._sidecar
+        self._sidecar = None
+        if sc and sc[0] == self._layout_key() and len(sc[2]) == len(self.lines):
+            self.renderer.adopt_layout(sc[1], sc[2], sc[3], sc[4], sc[5])
+
+    def _save_layout(self):
+        """Write the sidecar after a full measurement pass."""
+        r = self.renderer
+        if not self._doc_key or r._collapsed_headers:
+            return
+        key = self._layout_key()
+        if key == self._saved_key:
+            return
+        conts = [e is _CONT for e in r._dlist]
+        layout_cache.save(self.filename, key, r._content_height,
+                          r._line_y_cache, r._line_fence_cache, conts,
+                          r._formula_cache)
+        self._saved_key = key
+
+    def ensure_renderer(self, x=5, y=5, width=310, height=230):
+        """Create the renderer on first use, adopting a matching sidecar.
+
+        Draws nothing and leaves the shared GROBs alone.
+        """
+        if not self.renderer:
+            self.renderer = MarkdownRenderer(GR_BACK, x, y, width, height)
+            self._apply_sidecar()
+            self.renderer.on_measured = self._save_layout
+        return self.renderer
+
     def render(self, gr, x=5, y=5, width=310, height=230):
         """Render the document to the back buffer, then flip to screen."""
         self._ensure_back_buffer(320, 240)
-        if not self.renderer:
-            self.renderer = MarkdownRenderer(GR_BACK, x, y, width, height)
-        self.renderer.render(self.lines)
+        r = self.ensure_renderer(x, y, width, height)
+        r.use_strip = self._strip_inited
+        r.render(self.lines)
         self._flip(x, y, width, height)
 
     def scroll_up(self):
@@ -1547,12 +2790,13 @@ class MarkdownDocument:
 
         Falls back to full render for large deltas or when no cache exists.
         Uses pixel shifting to avoid re-rendering the entire viewport.
+        With the strip cache, render() is already a blit of cached rows.
         """
         if not self.renderer:
             return
         r = self.renderer
         # Fall back to full render for large deltas or uncached content
-        if (not r._line_y_cache or r._content_height == 0
+        if (r.use_strip or not r._line_y_cache
                 or abs(delta) >= r.height // 2):
             r.scroll_by(delta)
             r.render(self.lines)
@@ -1565,7 +2809,6 @@ class MarkdownDocument:
         if actual == 0:
             return
 
-        from hpprime import strblit2, fillrect as _fr
         bb = GR_BACK
         x = r.x
         y = r.y
@@ -1579,13 +2822,13 @@ class MarkdownDocument:
             strblit2(bb, x, y, w, h - ad,
                      bb, x, y + ad, w, h - ad)
             # Clear exposed strip at bottom
-            _fr(bb, x, y + h - ad, w, ad, bg, bg)
+            fillrect(bb, x, y + h - ad, w, ad, bg, bg)
         else:
             # Scrolling up: shift back buffer content down
             strblit2(bb, x, y + ad, w, h - ad,
                      bb, x, y, w, h - ad)
             # Clear exposed strip at top
-            _fr(bb, x, y, w, ad, bg, bg)
+            fillrect(bb, x, y, w, ad, bg, bg)
 
         # Render to back buffer, then flip to screen
         r.render(self.lines)
@@ -1615,6 +2858,8 @@ class MarkdownDocument:
     def scroll_to_bottom(self):
         if self.renderer:
             r = self.renderer
+            # The end of the document needs the exact content height
+            r.measure_step(self.lines)
             r.scroll_to_bottom()
             r.render(self.lines)
             self._flip(r.x, r.y, r.width, r.height)
@@ -0,0 +1,252 @@
+"""Debug frame profiler: per-subsystem call counts and ticks.
+
+When enabled, the hpprime entry points used by graphics.py,
+input_helpers.py, tasks.py, ui.py and markdown_viewer.py (including
+the back-buffer flip) are replaced by wrappers that count calls and
+elapsed milliseconds per subsystem:
+
+    text   TEXTOUT_P / TEXTSIZE evals
+    rects  fillrect and RECT_P evals
+    blits  strblit2, dimgrob and BLIT_P / GROB evals
+    batch  ';'-joined drawing batches (mixed text and rects)
+    input  key, touch and tick polling
+    gc     gc.collect()
+
+frame() is called once per main loop iteration; it closes the
+previous frame and redraws the HUD when the frame drew something.
+dump() appends a session summary to profile.txt.
+
+Timing uses utime.ticks_ms() when available, else a PPL ticks()
+eval per measurement (which is not counted, but does add overhead).
+"""
+
+from micropython import const
+from hpprime import eval as _heval, fillrect as _fillrect
+import gc as _gc
+from constants import GR_AFF, FONT_10
+
+_TEXT = const(0)
+_RECTS = const(1)
+_BLITS = const(2)
+_BATCH = const(3)
+_INPUT = const(4)
+_GC = const(5)
+_NSUB = const(6)
+NAMES = ('text', 'rects', 'blits', 'batch', 'input', 'gc')
+_HUD_TAGS = 'TRBDIG'
+
+PROFILE_FILE = 'profile.txt'
+
+try:
+    from utime import ticks_ms as _ticks
+except:
+    def _ticks():
+        return int(_heval('ticks()'))
+
+enabled = False
+_saved = []               # (module, name, original) to restore
+
+# Current frame
+_calls = [0] * _NSUB
+_ms = [0] * _NSUB
+_evals = 0
+_frame_t0 = 0
+
+# Session totals
+_tot_calls = [0] * _NSUB
+_tot_ms = [0] * _NSUB
+_tot_evals = 0
+_frames = 0
+_frame_ms_sum = 0
+_frame_ms_max = 0
+_session_t0 = 0
+
+
+def _add(sub, ms, is_eval):
+    global _evals
+    _calls[sub] += 1
+    _ms[sub] += ms
+    if is_eval:
+        _evals += 1
+
+
+def _classify(cmd):
+    """Map a PPL command string to a subsystem."""
+    if ');' in cmd:
+        return _BATCH
+    if cmd.startswith('TEXT'):
+        return _TEXT
+    if cmd.startswith('RECT'):
+        return _RECTS
+    return _BLITS
+
+
+def _wrap_eval(fn, sub):
+    if sub < 0:
+        def w(cmd):
+            t = _ticks()
+            r = fn(cmd)
+            _add(_classify(cmd), _ticks() - t, True)
+            return r
+    else:
+        def w(cmd):
+            t = _ticks()
+            r = fn(cmd)
+            _add(sub, _ticks() - t, True)
+            return r
+    return w
+
+
+def _wrap(fn, sub):
+    def w(*args):
+        t = _ticks()
+        r = fn(*args)
+        _add(sub, _ticks() - t, False)
+        return r
+    return w
+
+
+class _GcProxy:
+    """Stands in for the gc module so collect() is timed."""
+
+    def collect(self):
+        t = _ticks()
+        _gc.collect()
+        _add(_GC, _ticks() - t, False)
+
+    def __getattr__(self, name):
+        return getattr(_gc, name)
+
+
+def _patch(module, name, wrapper):
+    orig = getattr(module, name, None)
+    if orig is None:
+        return
+    _saved.append((module, name, orig))
+    setattr(module, name, wrapper(orig))
+
+
+def reset():
+    """Clear the current frame and the session totals."""
+    global _evals, _tot_evals, _frames, _frame_ms_sum, _frame_ms_max
+    global _frame_t0, _session_t0
+    for i in range(_NSUB):
+        _calls[i] = 0
+        _ms[i] = 0
+        _tot_calls[i] = 0
+        _tot_ms[i] = 0
+    _evals = 0
+    _tot_evals = 0
+    _frames = 0
+    _frame_ms_sum = 0
+    _frame_ms_max = 0
+    _frame_t0 = _session_t0 = _ticks()
+
+
+def enable():
+    """Install the counting wrappers and start a new session."""
+    global enabled
+    if enabled:
+        return
+    import graphics
+    import input_helpers
+    import markdown_viewer
+    import tasks
+    import ui
+    _patch(graphics, 'eval', lambda f: _wrap_eval(f, -1))
+    _patch(graphics, 'fillrect', lambda f: _wrap(f, _RECTS))
+    _patch(graphics, 'dimgrob', lambda f: _wrap(f, _BLITS))
+    _patch(input_helpers, 'heval', lambda f: _wrap_eval(f, _INPUT))
+    _patch(tasks, '_heval', lambda f: _wrap_eval(f, _INPUT))
+    _patch(tasks, '_keyboard', lambda f: _wrap(f, _INPUT))
+    _patch(markdown_viewer, 'strblit2', lambda f: _wrap(f, _BLITS))
+    _patch(markdown_viewer, 'dimgrob', lambda f: _wrap(f, _BLITS))
+    _patch(markdown_viewer, 'fillrect', lambda f: _wrap(f, _RECTS))
+    _patch(ui, 'fillrect', lambda f: _wrap(f, _RECTS))
+    _patch(ui, 'strblit2', lambda f: _wrap(f, _BLITS))
+    _patch(ui, 'dimgrob', lambda f: _wrap(f, _BLITS))
+    proxy = _GcProxy()
+    for m in (graphics, markdown_viewer):
+        _patch(m, 'gc', lambda f: proxy)
+    reset()
+    enabled = True
+
+
+def disable():
+    """Restore the original hpprime entry points."""
+    global enabled
+    while _saved:
+        module, name, orig = _saved.pop()
+        setattr(module, name, orig)
+    enabled = False
+
+
+def frame():
+    """Close the current frame; update totals and the HUD if it drew."""
+    global _evals, _tot_evals, _frames, _frame_ms_sum, _frame_ms_max
+    global _frame_t0
+    if not enabled:
+        return
+    now = _ticks()
+    dt = now - _frame_t0
+    _frame_t0 = now
+    drew = False
+    for i in range(_NSUB):
+        if i != _INPUT and _calls[i]:
+            drew = True
+        _tot_calls[i] += _calls[i]
+        _tot_ms[i] += _ms[i]
+    _tot_evals += _evals
+    if drew:
+        _frames += 1
+        _frame_ms_sum += dt
+        if dt > _frame_ms_max:
+            _frame_ms_max = dt
+        _draw_hud(dt)
+    for i in range(_NSUB):
+        _calls[i] = 0
+        _ms[i] = 0
+    _evals = 0
+
+
+def _draw_hud(dt):
+    """Draw 'frame ms, evals, per-subsystem ms' at the top-right."""
+    parts = ['%dms %dev' % (dt, _evals)]
+    for i in range(_NSUB):
+        if _ms[i]:
+            parts.append('%s%d' % (_HUD_TAGS[i], _ms[i]))
+    label = ' '.join(parts)
+    w = len(label) * 5 + 6
+    x = 320 - w
+    _fillrect(GR_AFF, x, 3, w, 12, 0x000000, 0x000000)
+    _heval('TEXTOUT_P("%s",G%d,%d,%d,%d,RGB(255,255,0),%d)'
+           % (label, GR_AFF, x + 3, 4, FONT_10, w))
+
+
+def summary(name=None):
+    """Return the session summary as a list of text lines."""
+    secs = (_ticks() - _session_t0) / 1000.0
+    lines = ['== profile' + (': ' + name if name else '')
+             + ' (%.1fs)' % secs]
+    avg = _frame_ms_sum // _frames if _frames else 0
+    lines.append('frames %d  avg %dms  max %dms' % (
+        _frames, avg, _frame_ms_max))
+    lines.append('evals %d  per frame %.1f' % (
+        _tot_evals, _tot_evals / _frames if _frames else 0.0))
+    lines.append('subsystem  calls  ms')
+    for i in range(_NSUB):
+        lines.append('%-9s  %5d  %d' % (NAMES[i], _tot_calls[i], _tot_ms[i]))
+    return lines
+
+
+def dump(name=None):
+    """Append the session summary to PROFILE_FILE and start a new session."""
+    if not enabled:
+        return
+    frame()
+    try:
+        with open(PROFILE_FILE, 'a') as f:
+            f.write('\n'.join(summary(name)) + '\n\n')
+    except:
+        pass
+    reset()
@@ -0,0 +1,292 @@
+"""Per-line bigram index for document search.
+
+Each source line gets a 30-bit mask of the byte bigrams of its
+lowercased UTF-8 text.  Lines and queries are lowercased the same way
+(str.lower(); plain bytes.lower() for ASCII-only lines), so the masks
+agree with the lowercased substring test.  A query can only match lines whose mask holds
+every bigram of the query, so most lines are rejected with one AND and
+only candidates are decoded and checked with a substring test.
+
+The index is built in chunks (build_step) so it can be filled during
+idle time after the document opens; find() completes it if needed.
+Matches are (line, char offset) pairs; narrow() refines them as a
+query grows by a character without touching non-matching lines.
+
+find_regex() runs a regular expression (ure) line by line.  Compiled
+patterns are cached, a literal the pattern requires is used to filter
+lines through the masks, and the scan stops after a match limit or a
+time budget so a slow pattern cannot stall the UI.
+"""
+
+from micropython import const
+from array import array
+try:
+    import ure as re
+except:
+    import re
+try:
+    from utime import ticks_ms as _ticks
+except:
+    from hpprime import eval as _heval
+
+    def _ticks():
+        return int(_heval('ticks()'))
+
+REGEX_CACHE_SIZE = const(8)    # compiled patterns kept
+_TICK_LINES = const(32)        # lines scanned between time checks
+
+_rx_cache = {}
+
+
+def _mask(raw):
+    """Bigram mask of a lowercased bytes string."""
+    m = 0
+    n = len(raw)
+    if n < 2:
+        return m
+    p = raw[0]
+    for i in range(1, n):
+        c = raw[i]
+        m |= 1 << ((p * 7 + c) % 30)
+        p = c
+    return m
+
+
+def _fold(raw):
+    """Lowercase the UTF-8 bytes of a line like str.lower() would."""
+    if raw and max(raw) >= 0x80:
+        try:
+            return raw.decode().lower().encode()
+        except:
+            pass
+    return raw.lower()
+
+
+def fold_pattern(pattern):
+    """Lowercase a pattern for case-insensitive matching.
+
+    Letters after a backslash (\\d, \\S, ...) keep their case.
+    """
+    out = []
+    esc = False
+    for ch in pattern:
+        out.append(ch if esc else ch.lower())
+        esc = not esc and ch == '\\'
+    return ''.join(out)
+
+
+def compile_pattern(pattern):
+    """Compile a regular expression through a small cache.
+
+    Raises ValueError (ure) or re.error for an invalid pattern.
+    """
+    rx = _rx_cache.get(pattern)
+    if rx is None:
+        rx = re.compile(pattern)
+        if len(_rx_cache) >= REGEX_CACHE_SIZE:
+            _rx_cache.clear()
+        _rx_cache[pattern] = rx
+    return rx
+
+
+def regex_spans(rx, text, anchored=False):
+    """Return a flat list of (start, end) offsets of rx matches in text.
+
+    Empty matches are skipped.  Scans by slicing, so anchored patterns
+    ('^...') stop at the first match.
+    """
+    out = []
+    pos = 0
+    n = len(text)
+    while pos <= n:
+        m = rx.search(text[pos:] if pos else text)
+        if m is None:
+            break
+        g = m.group(0)
+        try:
+            start = pos + m.start(0)
+        except:
+            start = text.find(g, pos)
+        end = start + len(g)
+        if end > start:
+            out.append(start)
+            out.append(end)
+        if anchored:
+            break
+        pos = end if end > start else start + 1
+    return out
+
+
+def _literal(pattern):
+    """Longest literal run every match of pattern must contain.
+
+    Conservative: returns '' for alternations, and ignores groups,
+    classes and characters made optional by ?, * or {.
+    """
+    best = ''
+    run = ''
+    depth = 0
+    i = 0
+    n = len(pattern)
+    while i < n:
+        ch = pattern[i]
+        i += 1
+        if ch == '|':
+            return ''
+        if ch == '\\' and i < n:
+            ch = pattern[i]
+            i += 1
+            if ch.isalpha() or ch.isdigit():
+                ch = None       # \d, \w, \b, ...: not a literal
+        elif ch == '(':
+            depth += 1
+            ch = None
+        elif ch == ')':
+            depth -= 1
+            ch = None
+        elif ch == '[':
+            while i < n and pattern[i] != ']':
+                i += 1
+            i += 1
+            ch = None
+        elif ch in '?*{':
+            if ch == '{':
+                while i < n and pattern[i] != '}':
+                    i += 1
+                i += 1
+            run = run[:-1]
+            ch = None
+        elif ch in '.^$+':
+            ch = None
+        if ch is None or depth:
+            if len(run) > len(best):
+                best = run
+            run = ''
+        else:
+            run += ch
+    if len(run) > len(best):
+        best = run
+    return best
+
+
+class SearchIndex:
+    """Bigram masks for the lines of one document."""
+
+    def __init__(self, lines):
+        self._lines = lines
+        self._masks = array('I')
+        if hasattr(lines, 'raw_lines'):
+            self._src = lines.raw_lines()
+        else:
+            self._src = (line.encode() for line in lines)
+
+    def done(self):
+        """Return True once every line has a mask."""
+        return self._src is None
+
+    def build_step(self, max_lines=0):
+        """Index up to max_lines more lines (all when 0).
+
+        Returns True once the index is complete.
+        """
+        src = self._src
+        if src is None:
+            return True
+        masks = self._masks
+        k = 0
+        for raw in src:
+            masks.append(_mask(_fold(raw)))
+            k += 1
+            if k == max_lines:
+                return False
+        self._src = None
+        return True
+
+    def find(self, term, case_sensitive=False, limit=0):
+        """Find every occurrence of term, overlapping ones included.
+
+        Returns (matches, complete): matches is a flat array of
+        (line, char offset) pairs in document order, and complete is
+        False when the search stopped after limit matches.
+        """
+        matches = array('I')
+        if not term:
+            return (matches, True)
+        self.build_step()
+        q = _mask(term.lower().encode())
+        t = term if case_sensitive else term.lower()
+        lines = self._lines
+        masks = self._masks
+        for i in range(len(masks)):
+            if masks[i] & q == q:
+                line = lines[i]
+                if not case_sensitive:
+                    line = line.lower()
+                k = line.find(t)
+                while k >= 0:
+                    if limit and len(matches) >= 2 * limit:
+                        return (matches, False)
+                    matches.append(i)
+                    matches.append(k)
+                    k = line.find(t, k + 1)
+        return (matches, True)
+
+    def narrow(self, matches, term, case_sensitive=False):
+        """Keep the matches of a previous query that also match term.
+
+        term must start with the previous query, so every occurrence of
+        term is one of the previous matches and no line is rescanned.
+        """
+        out = array('I')
+        t = term if case_sensitive else term.lower()
+        n = len(t)
+        lines = self._lines
+        li = -1
+        line = ''
+        for k in range(0, len(matches), 2):
+            i = matches[k]
+            if i != li:
+                li = i
+                line = lines[i]
+                if not case_sensitive:
+                    line = line.lower()
+            off = matches[k + 1]
+            if line[off:off + n] == t:
+                out.append(i)
+                out.append(off)
+        return out
+
+    def find_regex(self, pattern, case_sensitive=False, limit=0,
+                   budget_ms=0):
+        """Find matches of a regular expression, line by line.
+
+        Returns (matches, complete) like find(); complete is False when
+        the scan stopped at limit matches or after budget_ms.  Raises
+        on an invalid pattern.
+        """
+        if not case_sensitive:
+            pattern = fold_pattern(pattern)
+        rx = compile_pattern(pattern)
+        anchored = pattern.startswith('^')
+        self.build_step()
+        q = _mask(_literal(pattern).lower().encode())
+        lines = self._lines
+        masks = self._masks
+        matches = array('I')
+        t0 = _ticks() if budget_ms else 0
+        for i in range(len(masks)):
+            if budget_ms and i % _TICK_LINES == 0 and i:
+                if _ticks() - t0 > budget_ms:
+                    return (matches, False)
+            if masks[i] & q != q:
+                continue
+            line = lines[i]
+            if not case_sensitive:
+                line = line.lower()
+            sp = regex_spans(rx, line, anchored)
+            for k in range(0, len(sp), 2):
+                if limit and len(matches) >= 2 * limit:
+                    return (matches, False)
+                matches.append(i)
+                matches.append(sp[k])
+        return (matches, True)
@@ -0,0 +1,85 @@
+"""Cooperative background tasks run between input polls.
+
+A task is a step function, the same shape as measure_step() or
+build_step(): each call does one small unit of work and returns True
+while it has more to do right now.  Tasks are kept in registration
+order, which is also their priority; a task that returns False is
+skipped for the rest of that run() and asked again next time, so it
+can stay registered while it waits for work (prefetch with no link in
+view, prefs with nothing to write).
+
+run() steps tasks until its slice (TASK_SLICE_MS) is spent, no task
+has work, or a key or touch is pending.  Steps are never interrupted;
+input is checked between them, so a slice overruns by at most one
+step.
+"""
+
+from micropython import const
+from hpprime import eval as _heval, keyboard as _keyboard
+
+TASK_SLICE_MS = const(30)      # idle work per main-loop iteration
+
+try:
+    from utime import ticks_ms as _ticks, ticks_diff as _ticks_diff
+except:
+    def _ticks():
+        return int(_heval('ticks()'))
+
+    def _ticks_diff(a, b):
+        return a - b
+
+_tasks = []         # [name, step], highest priority first
+
+
+def add(name, step):
+    """Register step under name, replacing a task of the same name."""
+    for t in _tasks:
+        if t[0] == name:
+            t[1] = step
+            return
+    _tasks.append([name, step])
+
+
+def remove(name):
+    """Unregister the task called name, if any."""
+    for i in range(len(_tasks)):
+        if _tasks[i][0] == name:
+            del _tasks[i]
+            return
+
+
+def input_pending():
+    """Return True while a key is held or the screen is touched."""
+    if _keyboard():
+        return True
+    m = _heval('mouse')
+    if m:
+        f = m[0]
+        if type(f) is list:
+            return len(f) >= 2 and f[0] >= 0
+        return type(f) in (int, float) and len(m) >= 2 and m[0] >= 0
+    return False
+
+
+def run(slice_ms=TASK_SLICE_MS):
+    """Step the registered tasks for up to slice_ms milliseconds.
+
+    Returns True if some task did work.
+    """
+    t0 = _ticks()
+    idle = []
+    worked = False
+    while True:
+        step = None
+        for t in _tasks:
+            if t[1] not in idle:
+                step = t[1]
+                break
+        if step is None:
+            return worked
+        if step():
+            worked = True
+        else:
+            idle.append(step)
+        if _ticks_diff(_ticks(), t0) >= slice_ms or input_pending():
+            return worked
@@ -6,7 +6,7 @@ If not provided, ``theme.colors`` is used as the default palette.
 Required color keys per component:
 
 draw_menu:        menu_bg, menu_text, menu_divider
-show_input_bar:   table_header_bg, table_border, header, bg, normal
+show_search_bar:  table_header_bg, table_border, header, normal
 show_context_menu: ctx_bg, ctx_border, ctx_text
 show_list_manager: bg, header, italic, normal, table_border,
                    browser_sel, browser_sel_text, bookmark_mark (optional)
@@ -16,8 +16,10 @@ from constants import (GR_AFF, FONT_10, FONT_12, FONT_14,
     NOTCH_X, NOTCH_Y, NOTCH_W, NOTCH_H, GR_MENU_SAVE, MENU_HEIGHT)
 from hpprime import fillrect, strblit2, dimgrob
 from graphics import draw_text, draw_rectangle, text_width
-from keycodes import KEY_ENTER, KEY_ESC, KEY_BACKSPACE, KEY_UP, KEY_DOWN
-from input_helpers import get_key, get_touch, mouse_clear
+from keycodes import (KEY_ENTER, KEY_ESC, KEY_BACKSPACE, KEY_UP, KEY_DOWN,
+    KEY_ALPHA, KEY_SHIFT, KEY_F1, ALPHA_CHARS, DIGIT_CHARS, SYMBOL_CHARS,
+    SYMBOL_LEGEND)
+from input_helpers import poll_input, mouse_clear, PollPolicy
 
 
 def _c(colors):
@@ -110,10 +112,6 @@ def restore_menu_area(menu_y=220, menu_h=20):
              GR_MENU_SAVE, 0, 0, 320, menu_h)
 
 
-# ---------------------------------------------------------------------------
-# Text input bar
-# ---------------------------------------------------------------------------
-
 # ---------------------------------------------------------------------------
 # Search history
 # ---------------------------------------------------------------------------
@@ -146,83 +144,106 @@ def _add_to_search_history(term):
     _save_search_history(history[:_MAX_HISTORY])
 
 
-def show_search_input(case_sensitive=False, menu_y=220, colors=None):
-    """Show search input with history and case-sensitivity toggle.
+# ---------------------------------------------------------------------------
+# Search bar (find as you type)
+# ---------------------------------------------------------------------------
 
-    Returns (term, case_sensitive) tuple, or (None, case_sensitive) on cancel.
+_KEY_MODES = ('abc', '123', 'sym')
+_KEY_MAPS = (ALPHA_CHARS, DIGIT_CHARS, SYMBOL_CHARS)
+
+
+def _draw_search_bar(term, mode, cs, rx, count, menu_y, c):
+    """Draw the one-line search bar over the menu area.
+
+    In symbol mode a legend line for the keypad is drawn above the bar.
     """
-    from hpprime import eval as heval
+    bg = c['table_header_bg']
+    fillrect(GR_AFF, 0, menu_y, 320, 240 - menu_y, c['table_border'], bg)
+    if mode == 2:
+        fillrect(GR_AFF, 0, menu_y - 14, 320, 14, c['table_border'], bg)
+        draw_text(GR_AFF, 4, menu_y - 12, SYMBOL_LEGEND, FONT_10,
+                  c['normal'])
+    flags = _KEY_MODES[mode] + (' Aa' if cs else ' aa')
+    info = count + '  ' + flags
+    iw = text_width(info, FONT_10)
+    draw_text(GR_AFF, 320 - iw - 4, menu_y + 4, info, FONT_10, c['normal'])
+    label = 'Regex:' if rx else 'Find:'
+    lw = text_width(label, FONT_10)
+    draw_text(GR_AFF, 4, menu_y + 4, label, FONT_10, c['header'])
+    # Show the tail of long terms
+    room = 320 - iw - lw - 20
+    shown = term + '_'
+    while len(shown) > 1 and text_width(shown, FONT_10) > room:
+        shown = shown[1:]
+    draw_text(GR_AFF, lw + 8, menu_y + 4, shown, FONT_10, c['normal'])
+
+
+def show_search_bar(on_change, case_sensitive=False, regex=False,
+                    menu_y=220, colors=None):
+    """Incremental search bar: on_change runs after every edit.
+
+    Keys type letters (ALPHA cycles letters, digits and operators, and
+    regex symbols), SHIFT toggles case sensitivity, F1 toggles regex
+    mode, UP/DOWN recall recent terms, ENTER accepts and ESC cancels.
+    on_change(term, case_sensitive, regex) returns the match count label
+    shown at the right of the bar; it is also called with an empty term
+    when the term is erased (so the caller can clear its highlights) and
+    when the symbol legend is removed, so the caller can repaint.
+
+    Returns (term, case_sensitive, regex) tuple, or (None, case_sensitive,
+    regex) on cancel.
+    """
+    c = _c(colors)
     history = _load_search_history()
+    hist_idx = -1
+    term = ''
     cs = case_sensitive
-
+    rx = regex
+    mode = 0
+    count = ''
+    mouse_clear()
+    poll = PollPolicy()
+    _draw_search_bar(term, mode, cs, rx, count, menu_y, c)
     while True:
-        heval('print')  # Clear terminal screen
-        cs_label = '[Aa]' if cs else '[aa]'
-        print('Search ' + cs_label)
-        if history:
-            print('Recent:')
-            # Two-column layout to avoid scrollbar
-            n = len(history)
-            half = (n + 1) // 2  # rows needed
-            nw = len(str(n))  # digit width for largest index
-            # Find max term width in left column
-            max_term = 0
-            for i in range(half):
-                if len(history[i]) > max_term:
-                    max_term = len(history[i])
-            # col_w = index_width + space + term + gap
-            col_w = nw + 1 + max_term + 2
-            max_line = 38
-            # Cap left column so right column has room
-            max_col = max_line // 2
-            if col_w > max_col:
-                max_term = max_col - nw - 3
-                col_w = max_col
-            for row in range(half):
-                li = row
-                ri = row + half
-                # Left entry: right-align number, pad term
-                num_l = str(li + 1)
-                num_l = ' ' * (nw - len(num_l)) + num_l
-                term_l = history[li]
-                if len(term_l) > max_term:
-                    term_l = term_l[:max_term - 1] + '.'
-                left = num_l + ' ' + term_l
-                if ri < n:
-                    num_r = str(ri + 1)
-                    num_r = ' ' * (nw - len(num_r)) + num_r
-                    remaining = max_line - col_w - nw - 1
-                    term_r = history[ri]
-                    if len(term_r) > remaining:
-                        term_r = term_r[:remaining - 1] + '.'
-                    right = num_r + ' ' + term_r
-                    line = left + ' ' * (col_w - len(left)) + right
-                else:
-                    line = left
-                print(line)
-        print('')
-        print('#=pick  !=case  empty=cancel')
-        try:
-            result = input('')
-        except:
-            return (None, cs)
-        if not result or not result.strip():
-            return (None, cs)
-        result = result.strip()
-        if result == '!':
-            cs = not cs
+        k = poll_input(poll)[0]
+        poll.update(k >= 0)
+        if k < 0:
             continue
-        # Check for history shortcut
-        try:
-            idx = int(result) - 1
-            if 0 <= idx < len(history):
-                term = history[idx]
+        old_term, old_cs, old_rx = term, cs, rx
+        if k == KEY_ENTER:
+            if term:
                 _add_to_search_history(term)
-                return (term, cs)
-        except:
-            pass
-        _add_to_search_history(result)
-        return (result, cs)
+                return (term, cs, rx)
+            return (None, cs, rx)
+        elif k == KEY_ESC:
+            return (None, cs, rx)
+        elif k == KEY_BACKSPACE:
+            term = term[:-1]
+        elif k == KEY_ALPHA:
+            mode = (mode + 1) % 3
+            if mode == 0:
+                # Legend removed: let the caller repaint the content
+                count = on_change(term, cs, rx)
+                if not term:
+                    count = ''
+        elif k == KEY_SHIFT:
+            cs = not cs
+        elif k == KEY_F1:
+            rx = not rx
+        elif k == KEY_UP or k == KEY_DOWN:
+            if history:
+                step = 1 if k == KEY_UP else -1
+                hist_idx = max(-1, min(len(history) - 1, hist_idx + step))
+                term = history[hist_idx] if hist_idx >= 0 else ''
+        else:
+            ch = _KEY_MAPS[mode].get(k)
+            if ch:
+                term += ch
+        if term != old_term or (term and (cs != old_cs or rx != old_rx)):
+            count = on_change(term, cs, rx)
+            if not term:
+                count = ''
+        _draw_search_bar(term, mode, cs, rx, count, menu_y, c)
 
 
 # ---------------------------------------------------------------------------
@@ -277,11 +298,12 @@ def show_context_menu(x, y, items, content_bottom=220, colors=None):
     touch_down = False
     tap_x = -1
     tap_y = -1
+    poll = PollPolicy()
     while True:
-        k = get_key()
+        k, tx, ty, _ = poll_input(poll)
         if k == KEY_ESC:
             return -1
-        tx, ty = get_touch()
+        poll.update(k >= 0 or tx >= 0)
         if tx >= 0 and ty >= 0:
             touch_down = True
             tap_x = tx
@@ -377,9 +399,10 @@ def show_list_manager(title, subtitle, items, empty_lines=None,
     tap_x = -1
     tap_y = -1
 
+    poll = PollPolicy()
     while True:
-        k = get_key()
-        if k > 0:
+        k, tx, ty, _ = poll_input(poll)
+        if k >= 0:
             if k == KEY_ESC:
                 return None
             elif k == KEY_ENTER:
@@ -397,7 +420,7 @@ def show_list_manager(title, subtitle, items, empty_lines=None,
                     selected += 1
                     draw_mgr()
 
-        tx, ty = get_touch()
+        poll.update(k >= 0 or tx >= 0)
         if tx >= 0 and ty >= 0:
             touch_down = True
             tap_x = tx
@@ -489,11 +512,12 @@ def show_stats_dialog(filename, line_count, word_count, read_min,
     # Drain pending touch events before waiting for dismiss
     mouse_clear()
     touch_down = False
+    poll = PollPolicy()
     while True:
-        k = get_key()
+        k, tx, ty, _ = poll_input(poll)
         if k == KEY_ESC or k == KEY_ENTER:
             return
-        tx, ty = get_touch()
+        poll.update(k >= 0 or tx >= 0)
         if tx >= 0 and ty >= 0:
             touch_down = True
         elif touch_down:
@@ -568,11 +592,12 @@ def show_shortcuts_overlay(colors=None):
               c['ctx_border'])
     mouse_clear()
     touch_down = False
+    poll = PollPolicy()
     while True:
-        k = get_key()
-        if k > 0:
+        k, tx, ty, _ = poll_input(poll)
+        if k >= 0:
             return
-        tx, ty = get_touch()
+        poll.update(k >= 0 or tx >= 0)
         if tx >= 0 and ty >= 0:
             touch_down = True
         elif touch_down:
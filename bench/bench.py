@@ -0,0 +1,223 @@
+"""Desktop benchmark for the MarkdownViewer renderer.
+
+Runs the app modules under CPython against the counting ``hpprime``
+stub in this directory and times the main viewer operations:
+
+    open         load_markdown_file()
+    first_paint  first render()
+    page_down    one scroll_page_down() per frame (up to --pages)
+    measure      idle measurement steps until the layout is complete
+    search       search() for a common word
+    reopen       load + first render again (uses the layout sidecar)
+
+Output is a tab-separated table, one row per document and phase:
+
+    python bench/bench.py [--out bench_output.txt] [--pages N] [docs...]
+
+Without document arguments demo.md, help.md and synthetic documents
+of 10 KB, 100 KB and 1 MB are used.  Runs in a temporary directory so
+sidecars and glyph tables never land in the app directory.
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP = os.path.join(os.path.dirname(HERE), 'MarkdownViewer.hpappdir')
+sys.path.insert(0, HERE)
+sys.path.insert(1, APP)
+
+import hpprime  # noqa: E402  (the stub in this directory)
+
+COLUMNS = ('doc', 'bytes', 'lines', 'phase', 'frames', 'wall_ms',
+           'evals', 'cmds', 'evals_per_frame', 'eval_bytes',
+           'fillrect', 'strblit2', 'dimgrob')
+
+SYNTHETIC = (('synth_10k.md', 10 * 1024),
+             ('synth_100k.md', 100 * 1024),
+             ('synth_1m.md', 1024 * 1024))
+
+_WORDS = ('the', 'viewer', 'renders', 'markdown', 'on', 'a', 'small',
+          'screen', 'with', 'word', 'wrap', 'and', 'search', 'of', 'text',
+          'calculator', 'layout', 'cache', 'scroll', 'page', 'line', 'font')
+
+
+def _sentence(rnd, n):
+    words = [rnd.choice(_WORDS) for _ in range(n)]
+    if rnd.random() < 0.3:
+        i = rnd.randrange(n)
+        words[i] = '**' + words[i] + '**'
+    if rnd.random() < 0.2:
+        i = rnd.randrange(n)
+        words[i] = '`' + words[i] + '`'
+    return ' '.join(words).capitalize() + '.'
+
+
+def synth_doc(size, seed=1):
+    """Return a deterministic markdown document of about size bytes."""
+    rnd = random.Random(seed)
+    out = []
+    total = 0
+    section = 0
+    while total < size:
+        section += 1
+        block = ['## Section %d' % section, '']
+        kind = section % 4
+        if kind == 0:
+            block += ['- ' + _sentence(rnd, rnd.randint(3, 9))
+                      for _ in range(rnd.randint(3, 6))]
+        elif kind == 1:
+            block += ['```python']
+            block += ['x%d = %d  # %s' % (i, i * i, rnd.choice(_WORDS))
+                      for i in range(rnd.randint(3, 8))]
+            block += ['```']
+        elif kind == 2:
+            block += ['| Name | Value | Note |', '|------|-------|------|']
+            block += ['| %s | %d | %s |' % (rnd.choice(_WORDS), i,
+                                            rnd.choice(_WORDS))
+                      for i in range(rnd.randint(2, 5))]
+        else:
+            block += ['> ' + _sentence(rnd, rnd.randint(6, 14))]
+        block += ['']
+        for _ in range(rnd.randint(1, 3)):
+            block += [' '.join([_sentence(rnd, rnd.randint(5, 15))
+                                for _ in range(rnd.randint(2, 6))]), '']
+        text = '\n'.join(block) + '\n'
+        out.append(text)
+        total += len(text)
+    return ''.join(out)
+
+
+def _stat(name):
+    s = hpprime.STATS.get(name)
+    return s if s else [0, 0]
+
+
+def _measure(doc, nbytes, nlines, phase, fn):
+    """Run fn() with fresh counters and return one result row.
+
+    fn returns the number of frames it drew.
+    """
+    hpprime.reset()
+    t0 = time.perf_counter()
+    frames = fn()
+    wall = (time.perf_counter() - t0) * 1000.0
+    evals = _stat('eval')
+    return (doc, nbytes, nlines, phase, frames, '%.2f' % wall,
+            evals[0], _stat('cmd')[0],
+            '%.1f' % (evals[0] / float(frames)) if frames else '-',
+            evals[1], _stat('fillrect')[0], _stat('strblit2')[0],
+            _stat('dimgrob')[0])
+
+
+def bench_doc(name, pages, term='the'):
+    """Benchmark one document in the current directory."""
+    import graphics
+    from markdown_viewer import MarkdownViewer
+
+    graphics.text_width_clear_cache()
+    nbytes = os.path.getsize(name)
+    v = MarkdownViewer(0, height=232)
+    v.load_markdown_file(name)
+    nlines = len(v.document.lines)
+
+    def open_doc():
+        v.load_markdown_file(name)
+        return 0
+
+    def first_paint():
+        v.render()
+        return 1
+
+    def page_down():
+        r = v.document.renderer
+        frames = 0
+        for _ in range(pages):
+            before = r.scroll_offset
+            v.scroll_page_down()
+            frames += 1
+            if r.scroll_offset == before:
+                break
+        return frames
+
+    def measure():
+        frames = 0
+        while v.measure_pending():
+            v.measure_step()
+            frames += 1
+        return frames
+
+    def search():
+        v.search(term)
+        return 1
+
+    def reopen():
+        graphics.text_width_clear_cache()
+        v2 = MarkdownViewer(0, height=232)
+        v2.load_markdown_file(name)
+        v2.render()
+        return 1
+
+    return [_measure(name, nbytes, nlines, phase, fn)
+            for phase, fn in (('open', open_doc),
+                              ('first_paint', first_paint),
+                              ('page_down', page_down),
+                              ('measure', measure),
+                              ('search', search),
+                              ('reopen', reopen))]
+
+
+def main(argv):
+    out_path = None
+    pages = 20
+    docs = []
+    i = 0
+    while i < len(argv):
+        a = argv[i]
+        if a == '--out':
+            i += 1
+            out_path = os.path.abspath(argv[i])
+        elif a == '--pages':
+            i += 1
+            pages = int(argv[i])
+        else:
+            docs.append(os.path.abspath(a))
+        i += 1
+    synthetic = not docs
+    if synthetic:
+        docs = [os.path.join(APP, 'demo.md'), os.path.join(APP, 'help.md')]
+
+    work = tempfile.mkdtemp(prefix='mdv_bench_')
+    cwd = os.getcwd()
+    rows = []
+    try:
+        names = []
+        for path in docs:
+            shutil.copy(path, work)
+            names.append(os.path.basename(path))
+        if synthetic:
+            for fname, size in SYNTHETIC:
+                with open(os.path.join(work, fname), 'w') as f:
+                    f.write(synth_doc(size))
+                names.append(fname)
+        os.chdir(work)
+        for name in names:
+            rows.extend(bench_doc(name, pages))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work, ignore_errors=True)
+
+    text = '\n'.join(['\t'.join([str(c) for c in row])
+                      for row in [COLUMNS] + rows]) + '\n'
+    sys.stdout.write(text)
+    if out_path:
+        with open(out_path, 'w') as f:
+            f.write(text)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,115 @@
+"""Desktop stand-in for the HP Prime ``hpprime`` module.
+
+Only used by the benchmark suite: every entry point the app calls is
+counted, together with an argument size (characters for ``eval``,
+pixels for the drawing calls), and nothing is drawn.  ``TEXTSIZE``
+returns a deterministic width so layout behaves like on the device.
+"""
+
+import time
+
+# name -> [calls, total argument size]
+STATS = {}
+
+
+def reset():
+    STATS.clear()
+
+
+def _count(name, size):
+    s = STATS.get(name)
+    if s is None:
+        STATS[name] = [1, size]
+    else:
+        s[0] += 1
+        s[1] += size
+
+
+def _glyph_w(ch, font):
+    if ch in "il.,:;!|' ":
+        w = 4
+    elif ch.isupper():
+        w = 7
+    else:
+        w = 6
+    return w + font - 1
+
+
+def _split(cmd):
+    """Split a ';'-joined PPL command string outside string literals."""
+    parts = []
+    quoted = False
+    start = 0
+    i = 0
+    n = len(cmd)
+    while i < n:
+        c = cmd[i]
+        if quoted and c == '\\':
+            i += 2
+            continue
+        if c == '"':
+            quoted = not quoted
+        elif c == ';' and not quoted:
+            parts.append(cmd[start:i])
+            start = i + 1
+        i += 1
+    parts.append(cmd[start:])
+    return parts
+
+
+_t0 = time.time()
+
+
+def eval(cmd):
+    if not isinstance(cmd, str):
+        raise TypeError('eval expects a string')
+    _count('eval', len(cmd))
+    parts = _split(cmd)
+    if len(parts) > 1:
+        result = 0
+        for p in parts:
+            result = _command(p)
+        return result
+    return _command(cmd)
+
+
+def _command(cmd):
+    _count('cmd', len(cmd))
+    if cmd.startswith('TEXTSIZE("'):
+        end = cmd.rindex('",')
+        text = cmd[10:end].replace('\\"', '"').replace('\\\\', '\\')
+        font = int(cmd[end + 2:-1])
+        return [sum(_glyph_w(ch, font) for ch in text), 10 + 2 * font]
+    if cmd == 'GETKEY()':
+        return -1
+    if cmd == 'mouse':
+        return [[], []]
+    if cmd == 'mouse(1)':
+        return -1
+    if cmd in ('ticks()', 'ticks'):
+        return int((time.time() - _t0) * 1000)
+    if cmd.startswith('GROBW_P'):
+        return 100
+    if cmd.startswith('GROBH_P'):
+        return 50
+    if cmd in ('Language', 'Theme(1)', 'HSeparator'):
+        return 1
+    if cmd == 'AFiles()':
+        return []
+    return 0
+
+
+def fillrect(gr, x, y, w, h, edge, fill):
+    _count('fillrect', max(0, w) * max(0, h))
+
+
+def strblit2(dst, dx, dy, dw, dh, src, sx, sy, sw, sh):
+    _count('strblit2', max(0, dw) * max(0, dh))
+
+
+def dimgrob(gr, w, h, color=0):
+    _count('dimgrob', w * h)
+
+
+def keyboard():
+    return 0
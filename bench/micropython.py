@@ -0,0 +1,5 @@
+"""Desktop stand-in for MicroPython's ``micropython`` module."""
+
+
+def const(value):
+    return value
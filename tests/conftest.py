@@ -0,0 +1,29 @@
+"""Run the app modules under CPython with the stubs from bench/."""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+sys.path.insert(1, os.path.join(ROOT, 'MarkdownViewer.hpappdir'))
+
+
+@pytest.fixture
+def open_doc(tmp_path, monkeypatch):
+    """Return open(text, render=True): a viewer on text saved as doc.md.
+
+    Runs in tmp_path, so sidecars and prefs files stay out of the tree.
+    """
+    from markdown_viewer import MarkdownViewer
+    monkeypatch.chdir(tmp_path)
+
+    def open_(text, render=True):
+        (tmp_path / 'doc.md').write_text(text)
+        v = MarkdownViewer(0, height=232)
+        v.load_markdown_file('doc.md')
+        if render:
+            v.render()
+        return v
+    return open_
@@ -0,0 +1,35 @@
+"""Parking and prefetching linked documents."""
+
+import doc_cache
+from constants import INDEXED_LOAD_BYTES
+from markdown_viewer import MarkdownViewer
+
+
+def _load(name):
+    v = MarkdownViewer(0, height=232)
+    if v.load_markdown_file(name):
+        return v
+    v.close()
+    return None
+
+
+def test_prefetch_skips_large_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'small.md').write_text('# Small\n\ntext\n')
+    (tmp_path / 'big.md').write_text(('x' * 79 + '\n')
+                                         * (INDEXED_LOAD_BYTES // 80 + 1))
+    opened = []
+
+    def open_viewer(name):
+        opened.append(name)
+        return _load(name)
+    doc_cache.clear()
+    try:
+        links = ['big.md', 'small.md']
+        while doc_cache.prefetch_step(links, 'here.md', open_viewer):
+            pass
+        assert opened == ['small.md']
+        assert doc_cache.take('big.md') is None
+        assert doc_cache.take('small.md') is not None
+    finally:
+        doc_cache.clear()
@@ -0,0 +1,68 @@
+"""Batched PPL drawing and its fallback."""
+
+import graphics
+
+
+def _failing_eval(ran):
+    """eval that fails on the last of several joined commands."""
+    def ev(cmd):
+        parts = cmd.split(';')
+        if len(parts) > 1:
+            ran.extend(parts[:-1])
+            raise ValueError('joined commands not accepted')
+        ran.append(cmd)
+        return 0
+    return ev
+
+
+def test_failed_batch_runs_side_effects_once(monkeypatch):
+    ran = []
+    monkeypatch.setattr(graphics, 'eval', _failing_eval(ran))
+    monkeypatch.setattr(graphics, '_batch_ok', True)
+    graphics.begin_batch()
+    graphics.draw_text(1, 0, 0, 'a', 2, 0)
+    graphics.draw_text(1, 0, 10, 'b', 2, 0)
+    graphics.open_file(2, 'icon.png')
+    graphics.draw_text(1, 0, 20, 'c', 2, 0)
+    graphics.blit(1, 0, 0, 4, 4, 2, 0, 0, 4, 4, 0, 128)
+    graphics.end_batch()
+    assert sum(1 for c in ran if 'AFiles' in c) == 1
+    assert sum(1 for c in ran if c.startswith('BLIT_P')) == 1
+    # Text replayed after the failure, in order, then batching is off
+    assert [c[:8] for c in ran] == ['TEXTOUT_', 'TEXTOUT_', 'TEXTOUT_',
+                                    'G2:=AFil', 'TEXTOUT_', 'BLIT_P(G']
+    assert not graphics._batch_ok
+    assert not graphics._batching and not graphics._batch
+
+
+def test_bad_command_keeps_batching(monkeypatch):
+    def ev(cmd):
+        if 'bad' in cmd:
+            raise ValueError('bad command')
+        return 0
+    monkeypatch.setattr(graphics, 'eval', ev)
+    monkeypatch.setattr(graphics, '_batch_ok', True)
+    graphics.begin_batch()
+    graphics.draw_text(1, 0, 0, 'bad', 2, 0)
+    graphics.draw_text(1, 0, 10, 'b', 2, 0)
+    try:
+        graphics.end_batch()
+    except ValueError:
+        pass
+    assert graphics._batch == [] and graphics._batch_len == 0
+    assert graphics._batch_ok
+    graphics._batching = False
+
+
+def test_rectangle_stays_native_in_a_batch(monkeypatch):
+    calls = []
+    monkeypatch.setattr(graphics, 'eval', lambda cmd: calls.append(cmd[:7]))
+    monkeypatch.setattr(graphics, 'fillrect',
+                        lambda *a: calls.append('fillrect'))
+    monkeypatch.setattr(graphics, '_batch_ok', True)
+    graphics.begin_batch()
+    graphics.draw_text(1, 0, 0, 'a', 2, 0)
+    graphics.draw_rectangle(1, 0, 0, 10, 10, 0, 255, 0, 255)
+    graphics.draw_text(1, 0, 10, 'b', 2, 0)
+    graphics.end_batch()
+    assert calls == ['TEXTOUT', 'fillrect', 'TEXTOUT']
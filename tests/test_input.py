@@ -0,0 +1,50 @@
+"""Key polling and the search bar."""
+
+import input_helpers
+import ui
+from keycodes import KEY_ENTER, KEY_ESC, KEY_F1
+
+
+def _feed(monkeypatch, keys):
+    """Make poll_input return keys one by one (no touch)."""
+    keys = list(keys)
+    monkeypatch.setattr(ui, 'poll_input',
+                        lambda poll=None: (keys.pop(0), -1, -1, 0))
+
+
+def test_poll_input_no_key_is_minus_one(monkeypatch):
+    monkeypatch.setattr(input_helpers, '_combined', True)
+    monkeypatch.setattr(input_helpers, 'heval',
+                        lambda cmd: [0, -1, [[], []], 5])
+    assert input_helpers.poll_input() == (-1, -1, -1, 5)
+
+
+def test_poll_input_reports_key_zero(monkeypatch):
+    monkeypatch.setattr(input_helpers, '_combined', True)
+    monkeypatch.setattr(input_helpers, 'heval',
+                        lambda cmd: [0, KEY_F1, [[], []], 5])
+    assert input_helpers.poll_input() == (KEY_F1, -1, -1, 5)
+
+
+def test_fallback_keeps_key_zero(monkeypatch):
+    monkeypatch.setattr(input_helpers, '_combined', False)
+    answers = {'GETKEY()': KEY_F1, 'mouse': [[], []], 'ticks()': 7}
+    monkeypatch.setattr(input_helpers, 'heval',
+                        lambda cmd: answers.get(cmd, 0))
+    assert input_helpers.poll_input() == (KEY_F1, -1, -1, 7)
+
+
+def test_search_bar_f1_toggles_regex(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    _feed(monkeypatch, [-1, KEY_F1, -1, KEY_ESC])
+    calls = []
+    result = ui.show_search_bar(lambda t, cs, rx: calls.append(rx) or '')
+    assert result == (None, False, True)
+    # Nothing typed yet, so the regex flip does not search
+    assert calls == []
+
+
+def test_search_bar_f1_clears_regex(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    _feed(monkeypatch, [KEY_F1, KEY_ENTER])
+    assert ui.show_search_bar(lambda t, cs, rx: '', regex=True)[2] is False
@@ -0,0 +1,19 @@
+"""Header outline and section tree."""
+
+DOC = '''# Title
+text
+  # indented, not a header
+## Part
+```
+# in a fence
+```
+### Sub
+'''
+
+
+def test_outline_matches_section_tree(open_doc):
+    v = open_doc(DOC)
+    outline = v.get_headers()
+    assert outline == [(1, 'Title', 0), (2, 'Part', 3), (3, 'Sub', 7)]
+    secs = v.document.renderer._section_tree(v.document.lines)
+    assert sorted(secs) == [h[2] for h in outline]
@@ -0,0 +1,141 @@
+"""Strip cache and direct replay must put the same pixels on screen."""
+
+import random
+import re
+
+import pytest
+
+import graphics
+import hpprime
+import markdown_viewer
+from markdown_viewer import MarkdownViewer
+
+GLYPH_H = 9     # text cell height at font 0; fonts add 2 px per step
+
+_TEXT = re.compile(r'TEXTOUT_P\("(.*)",G(\d+),(-?\d+),(-?\d+),(\d+),'
+                   r'RGB\(([^)]*)\),(\d+)', re.S)
+_RECT = re.compile(r'RECT_P\(G(\d+),(-?\d+),(-?\d+),(-?\d+),(-?\d+),'
+                   r'RGB\(([^)]*)\),RGB\(([^)]*)\)\)$')
+
+
+class Pixels:
+    """hpprime drawing calls painted into per-GROB pixel rows.
+
+    Text is painted as a solid cell whose value identifies the string
+    and color, clipped like the device clips it.
+    """
+
+    def __init__(self, strip=True):
+        self.g = {0: [[0] * 320 for _ in range(240)]}
+        self.strip = strip
+
+    def dimgrob(self, g, w, h, color=0):
+        if g == markdown_viewer.GR_STRIP and not self.strip:
+            raise MemoryError
+        self.g[g] = [[color] * w for _ in range(h)]
+
+    def paint(self, g, x, y, w, h, v):
+        rows = self.g.get(g)
+        if rows is None:
+            return
+        x0 = max(0, x)
+        x1 = min(len(rows[0]), x + w)
+        for yy in range(max(0, y), min(len(rows), y + h)):
+            rows[yy][x0:x1] = [v] * max(0, x1 - x0)
+
+    def fillrect(self, g, x, y, w, h, edge, fill):
+        self.paint(g, x, y, w, h, fill)
+
+    def strblit2(self, d, dx, dy, dw, dh, s, sx, sy, sw, sh):
+        src = self.g.get(s)
+        if src is None or d not in self.g:
+            return
+        band = [row[sx:sx + sw] for row in src[max(0, sy):sy + sh]]
+        dst = self.g[d]
+        for i, row in enumerate(band):
+            if 0 <= dy + i < len(dst):
+                dst[dy + i][dx:dx + len(row)] = row
+
+    def eval(self, cmd):
+        parts = hpprime._split(cmd)
+        if len(parts) > 1:
+            for p in parts:
+                self.eval(p)
+            return 0
+        m = _RECT.match(cmd)
+        if m:
+            g, x1, y1, x2, y2 = [int(m.group(k)) for k in range(1, 6)]
+            r, gg, b = [int(t) for t in m.group(7).split(',')]
+            self.paint(g, x1, y1, x2 - x1 + 1, y2 - y1 + 1,
+                       (r << 16) | (gg << 8) | b)
+            return 0
+        m = _TEXT.match(cmd)
+        if m:
+            text, f = m.group(1), int(m.group(5))
+            w = hpprime._command('TEXTSIZE("%s",%d)' % (text, f))[0]
+            self.paint(int(m.group(2)), int(m.group(3)), int(m.group(4)),
+                       min(w, int(m.group(7))), GLYPH_H + 2 * f,
+                       hash((text, m.group(6))) & 0xFFFF)
+            return 0
+        return hpprime.eval(cmd)
+
+    def install(self, monkeypatch):
+        for mod in (graphics, markdown_viewer):
+            for name in ('eval', 'fillrect', 'strblit2', 'dimgrob'):
+                if hasattr(mod, name):
+                    monkeypatch.setattr(mod, name, getattr(self, name))
+
+    def viewport(self, r):
+        return [row[r.x:r.x + r.width]
+                for row in self.g[0][r.y:r.y + r.height]]
+
+
+def _doc(seed):
+    rnd = random.Random(seed)
+    words = ('alpha', 'beta', 'gamma', 'delta', 'code', 'table', 'wrap')
+    out = []
+    for k in range(60):
+        kind = rnd.randrange(6)
+        if kind == 0:
+            out.append('#' * rnd.randint(1, 3) + ' Section %d' % k)
+        elif kind == 1:
+            out.append('```python')
+            out.extend('x = %d  # %s' % (i, rnd.choice(words))
+                       for i in range(rnd.randint(2, 6)))
+            out.append('```')
+        elif kind == 2:
+            out.append('| a | b | c |')
+            out.append('|---|---|---|')
+            out.extend('| %s | %d | %s |' % (rnd.choice(words), i,
+                                              rnd.choice(words))
+                       for i in range(rnd.randint(1, 4)))
+        elif kind == 3:
+            out.extend('- ' + rnd.choice(words) for _ in range(3))
+        else:
+            out.append(' '.join(rnd.choice(words)
+                                for _ in range(rnd.randint(5, 60))))
+        out.append('')
+    return '\n'.join(out) + '\n'
+
+
+def _frames(open_doc, monkeypatch, text, strip):
+    px = Pixels(strip)
+    px.install(monkeypatch)
+    v = open_doc(text)
+    r = v.document.renderer
+    assert r.use_strip == strip
+    rnd = random.Random(7)
+    frames = [px.viewport(r)]
+    for _ in range(150):
+        v.scroll_by(rnd.choice((-37, -11, 5, 13, 29, 61, 117, -90)))
+        frames.append((r.scroll_offset, px.viewport(r)))
+    return frames
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_strip_matches_direct_replay(open_doc, monkeypatch, seed):
+    text = _doc(seed)
+    with_strip = _frames(open_doc, monkeypatch, text, True)
+    direct = _frames(open_doc, monkeypatch, text, False)
+    bad = [k for k in range(len(direct)) if with_strip[k] != direct[k]]
+    assert bad == []
@@ -0,0 +1,20 @@
+"""Wrapped text laid out as word runs."""
+
+from markdown_viewer import _OP_RUN, _OP_TEXT
+
+
+def _texts(v):
+    out = []
+    for rec in v.document.renderer._dlist:
+        for op in rec or ():
+            if op[0] == _OP_TEXT or op[0] == _OP_RUN:
+                out.append((op[6], op[4]))
+    return out
+
+
+def test_style_change_on_a_line_starts_a_new_run(open_doc):
+    v = open_doc('A *zebra* runs, **bold** then [a link](x.md) ~~gone~~.\n')
+    assert _texts(v) == [('normal', 'A'), ('italic', 'zebra'),
+                         ('normal', 'runs,'), ('bold', 'bold'),
+                         ('normal', 'then'), ('link', 'a link'),
+                         ('strikethrough', 'gone'), ('normal', '.')]
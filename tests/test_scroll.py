@@ -0,0 +1,24 @@
+"""Scrolling against a partially measured layout."""
+
+
+def test_ratio_scroll_is_clamped_when_measuring_ends(open_doc):
+    # Tall paragraphs first, then short lines: the height extrapolated
+    # from the measured prefix is far too large.
+    para = ' '.join(['word'] * 120)
+    text = '\n\n'.join([para] * 20) + '\n' + 'x\n' * 600
+    v = open_doc(text)
+    r = v.document.renderer
+    assert not r._measure_done
+    v.scroll_to_ratio(1.0)
+    v.render()
+    while v.measure_pending() and not r._measure_done:
+        v.measure_step()
+    assert r._measure_done
+    assert r.scroll_offset == r._max_scroll()
+
+
+def test_position_restored_before_first_render(open_doc):
+    v = open_doc('line\n\n' * 400, render=False)
+    v.set_scroll_position(500)
+    v.render()
+    assert v.get_scroll_position() == 500
@@ -0,0 +1,112 @@
+"""Find-as-you-type: narrowing and clearing."""
+
+import ui
+from keycodes import KEY_BACKSPACE, KEY_ESC
+from markdown_viewer import SEARCH_MAX_MATCHES
+from search_index import SearchIndex
+
+
+def _hit_lines(v):
+    hits = v.document.renderer._search_hits
+    return [hits[k] for k in range(0, len(hits), 2)]
+
+
+def test_capped_result_is_rescanned_not_narrowed(open_doc, monkeypatch):
+    # "a" matches more than SEARCH_MAX_MATCHES times before the first "ab"
+    n = SEARCH_MAX_MATCHES + 100
+    text = 'a\n' * n + 'ab\n' * 10
+    v = open_doc(text)
+    narrowed = []
+    real_narrow = SearchIndex.narrow
+
+    def narrow(self, matches, term, case_sensitive=False):
+        narrowed.append(term)
+        return real_narrow(self, matches, term, case_sensitive)
+    monkeypatch.setattr(SearchIndex, 'narrow', narrow)
+
+    v.search('a')
+    assert v.get_search_info()[1:] == (SEARCH_MAX_MATCHES, False)
+    v.search('ab')
+    assert narrowed == []
+    assert _hit_lines(v) == list(range(n, n + 10))
+    assert v.get_search_info()[1:] == (10, True)
+
+
+def test_complete_result_is_narrowed(open_doc, monkeypatch):
+    v = open_doc('ab\nac\nab\n')
+    narrowed = []
+    real_narrow = SearchIndex.narrow
+
+    def narrow(self, matches, term, case_sensitive=False):
+        narrowed.append(term)
+        return real_narrow(self, matches, term, case_sensitive)
+    monkeypatch.setattr(SearchIndex, 'narrow', narrow)
+
+    v.search('a')
+    v.search('ab')
+    assert narrowed == ['ab']
+    assert _hit_lines(v) == [0, 2]
+
+
+def test_erasing_the_term_clears_highlights(open_doc, monkeypatch):
+    v = open_doc('alpha\nbeta\n')
+    keys = [14, KEY_BACKSPACE, KEY_ESC]      # 'a', erase it, cancel
+    monkeypatch.setattr(ui, 'poll_input',
+                        lambda poll=None: (keys.pop(0), -1, -1, 0))
+    terms = []
+
+    def on_change(term, cs, rx):
+        terms.append(term)
+        v.search(term, case_sensitive=cs, regex=rx)
+        return ''
+    ui.show_search_bar(on_change)
+    assert terms == ['a', '']
+    assert v.document.renderer._search_hits == []
+    assert v.get_search_info() is None
+
+
+def _highlights(v, monkeypatch, term, regex=False):
+    """Search, then repaint and return the highlight rects drawn."""
+    import markdown_viewer
+    import theme
+    rects = []
+    real = markdown_viewer.draw_rectangle
+
+    def draw_rectangle(gr, x1, y1, x2, y2, edge, ea, fill, fa):
+        if fill == theme.colors['search_hl']:
+            rects.append((x1, y1, x2, y2))
+        real(gr, x1, y1, x2, y2, edge, ea, fill, fa)
+    monkeypatch.setattr(markdown_viewer, 'draw_rectangle', draw_rectangle)
+    v.search(term, regex=regex)
+    del rects[:]
+    v.document.renderer.invalidate_paint()
+    v.render()
+    return rects
+
+
+def test_every_match_is_highlighted(open_doc, monkeypatch):
+    v = open_doc('# Zebra facts\n\n'
+                 '```python\nx = zebra(1)\n```\n\n'
+                 '| Animal | Legs |\n|---|---|\n| zebra | 4 |\n\n'
+                 'A *zebra* runs.\n')
+    rects = _highlights(v, monkeypatch, 'zebra')
+    assert v.get_search_info()[1] == 4
+    assert len(rects) == 4
+    assert all(x2 > x1 for x1, _, x2, _ in rects)
+
+
+def test_regex_anchor_only_matches_at_line_start(open_doc, monkeypatch):
+    v = open_doc('zebra *zebra* **zebra** zebra\n')
+    rects = _highlights(v, monkeypatch, '^zebra', regex=True)
+    assert v.get_search_info()[1] == 1
+    assert len(rects) == 1
+    assert rects[0][0] == v.document.renderer.x
+
+
+def test_match_across_a_line_wrap(open_doc, monkeypatch):
+    words = ' '.join('w%02d' % i for i in range(60))
+    v = open_doc(words + '\n')
+    rects = _highlights(v, monkeypatch, words)
+    assert v.get_search_info()[1] == 1
+    ys = sorted(set(r[1] for r in rects))
+    assert len(ys) == len(rects) > 1
@@ -0,0 +1,22 @@
+"""Bigram search index."""
+
+from search_index import SearchIndex
+
+LINES = ['Élan vital', 'plain élan', 'nothing here', 'ÉLAN']
+
+
+def test_non_ascii_case_folding():
+    idx = SearchIndex(LINES)
+    hits, complete = idx.find('élan')
+    assert complete
+    assert list(hits) == [0, 0, 1, 6, 3, 0]
+
+
+def test_case_sensitive_non_ascii():
+    idx = SearchIndex(LINES)
+    assert list(idx.find('Élan', True)[0]) == [0, 0]
+
+
+def test_regex_non_ascii_literal():
+    idx = SearchIndex(LINES)
+    assert list(idx.find_regex('élan v')[0]) == [0, 0]
@@ -0,0 +1,28 @@
+"""Idle task scheduler."""
+
+import tasks
+
+
+def test_slice_spanning_tick_wrap(monkeypatch):
+    # ticks_ms wraps; with ticks_diff the slice ends after 30 ms, not at
+    # once (negative raw difference) and not never
+    period = 1 << 30
+    now = [period - 30]
+
+    def ticks():
+        now[0] = (now[0] + 10) % period
+        return now[0]
+
+    def diff(a, b):
+        return ((a - b + period // 2) % period) - period // 2
+    monkeypatch.setattr(tasks, '_ticks', ticks)
+    monkeypatch.setattr(tasks, '_ticks_diff', diff)
+    monkeypatch.setattr(tasks, 'input_pending', lambda: False)
+    steps = []
+
+    def step():
+        steps.append(1)
+        return len(steps) < 10
+    monkeypatch.setattr(tasks, '_tasks', [['t', step]])
+    assert tasks.run(30)
+    assert len(steps) == 3